@@ -0,0 +1,123 @@
+import argparse
+import os
+
+from affine_forms import parse_forms
+from instrumentation import NO_INSTRUMENTATION, Instrumentation
+from offset_analysis import PRIMALITY_BACKENDS, run_offset_pipeline
+from offset_reports import (AllPrimesReport, HardyLittlewoodReport, LastDigitReport, MainTableReport, ResidueClassReport,
+                            SuccessDistributionReport, TwinIndexReport)
+from prime_count import prime_share
+from results_store import ResultsStore, run_incremental
+from sieve_cache import DEFAULT_CACHE_FILE
+
+# --- Main script execution ---
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Produce every 7-offset report from a single pass over the twin primes.")
+    parser.add_argument("--start", type=int, default=0, help="analyze only twin primes with p >= START (default: 0)")
+    parser.add_argument("--limit", "--end", dest="limit", type=int, default=1_000_000,
+                        help="upper limit for p (default: 1,000,000)")
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes (default: 1)")
+    parser.add_argument("--main-table", action="store_true", help="also write the per-pair main table in the compact binary format")
+    parser.add_argument("--twin-index", action="store_true",
+                        help="also write the twin primes and their masks as an indexed store for rank and range queries")
+    parser.add_argument("--split-columns", action="store_true", help="write all and unique primes to two separate files")
+    parser.add_argument("--checkpoint", metavar="FILE", help="periodically save the run state to FILE")
+    parser.add_argument("--resume", action="store_true", help="continue from the state saved in the --checkpoint file")
+    parser.add_argument("--store", metavar="DIR", help="reuse and extend the results stored in DIR for these offsets")
+    parser.add_argument("--moduli", metavar="LIST",
+                        help="also group the successes by p mod m for each modulus, e.g. '10,30,210,2310'")
+    parser.add_argument("--expected", action="store_true",
+                        help="also write the Hardy-Littlewood expected counts next to the observed ones (per residue class of --moduli, default 10)")
+    parser.add_argument("--forms", metavar="LIST",
+                        help="comma-separated affine forms to test instead of the 7 offsets, e.g. '2p+1,3p-2,2(p+2)-3'")
+    parser.add_argument("--both-members", action="store_true", help="also apply every form to the partner p + 2")
+    parser.add_argument("--prime-share", action="store_true",
+                        help="after writing the reports, also give the unique primes as a share of all primes in the "
+                             "q-range (counts primes up to 2 * limit + 9, which takes minutes beyond about 10^13)")
+    parser.add_argument("--primality", choices=PRIMALITY_BACKENDS, default="sieve",
+                        help="how q-values are tested: sieve lookup, batched Miller-Rabin, or the persistent "
+                             "--sieve-cache file, which also supplies the twin primes (default: sieve)")
+    parser.add_argument("--sieve-cache", metavar="FILE", default=DEFAULT_CACHE_FILE,
+                        help=f"sieve cache file for --primality cache, extended as needed (default: {DEFAULT_CACHE_FILE})")
+    parser.add_argument("--progress", action="store_true",
+                        help="print pairs/s, q-tests/s, ETA and memory use every few seconds")
+    parser.add_argument("--profile", metavar="FILE", help="profile the run with cProfile and save the stats to FILE")
+    parser.add_argument("--trace-memory", action="store_true", help="trace allocations with tracemalloc (slows the run)")
+    parser.add_argument("--summary", metavar="FILE",
+                        help="write per-stage timings and counters to FILE as JSON (default with --progress, --profile "
+                             "or --trace-memory: 7offsets_run_summary.json)")
+    args = parser.parse_args()
+    if args.resume and not args.checkpoint:
+        parser.error("--resume requires --checkpoint")
+    if args.store and args.start:
+        parser.error("--store extends runs from p = 0 and cannot be combined with --start")
+    if args.both_members and not args.forms:
+        parser.error("--both-members requires --forms")
+    try:
+        MODULI = [int(modulus) for modulus in args.moduli.split(",")] if args.moduli else []
+    except ValueError:
+        parser.error("--moduli expects a comma-separated list of integers")
+    if any(modulus < 1 for modulus in MODULI):
+        parser.error("--moduli must all be positive")
+
+    # 1. Define the upper limit for twin prime search.
+    TWIN_PRIME_LIMIT = args.limit
+
+    # 2. Define the offsets to test.
+    OFFSETS = [1, 3, -3, -5, 7, 9, -9]
+    if args.forms:
+        try:
+            OFFSETS = parse_forms(args.forms, args.both_members)
+        except ValueError as error:
+            parser.error(str(error))
+
+    # Timers, counters and progress cost nothing unless one of these options asks for them.
+    SUMMARY_FILE = args.summary
+    if SUMMARY_FILE is None and (args.progress or args.profile or args.trace_memory):
+        SUMMARY_FILE = "7offsets_run_summary.json"
+    instrumentation = NO_INSTRUMENTATION
+    if SUMMARY_FILE is not None:
+        instrumentation = Instrumentation(args.progress, args.profile, args.trace_memory)
+
+    # 3. Generate the twin primes once, evaluate each (p, offset) once and feed every report.
+    # With a checkpoint, the primes spilled so far must survive alongside it.
+    spill_dir = os.path.dirname(os.path.abspath(args.checkpoint)) if args.checkpoint else None
+    reports = [AllPrimesReport(OFFSETS, args.split_columns, spill_dir), SuccessDistributionReport(OFFSETS), LastDigitReport(OFFSETS)]
+    if args.main_table:
+        reports.append(MainTableReport(OFFSETS))
+    if args.twin_index:
+        reports.append(TwinIndexReport(OFFSETS))
+    if args.moduli:
+        reports.append(ResidueClassReport(OFFSETS, MODULI))
+    if args.expected:
+        reports.append(HardyLittlewoodReport(OFFSETS, TWIN_PRIME_LIMIT, args.start, MODULI or [10]))
+    print(f"Finding twin primes with {args.start} <= p < {TWIN_PRIME_LIMIT} and analyzing offsets...")
+    with instrumentation:
+        if args.store:
+            run_incremental(ResultsStore(args.store), TWIN_PRIME_LIMIT, OFFSETS, reports, args.workers, args.checkpoint,
+                            args.resume, args.primality, args.sieve_cache, instrumentation)
+        else:
+            run_offset_pipeline(TWIN_PRIME_LIMIT, OFFSETS, reports, args.workers, args.checkpoint, args.resume,
+                                start=args.start, primality=args.primality, sieve_cache=args.sieve_cache,
+                                instrumentation=instrumentation)
+        print(f"Total twin prime pairs considered: {reports[0].twin_count}")
+        unique_count = reports[0].unique_primes.count()
+        print(f"Unique primes produced: {unique_count}")
+        print("-" * 50)
+
+        # 4. Write each report to its CSV file.
+        for report in reports:
+            print(f"Writing results to '{report.file_name}'...")
+            with instrumentation.timer(f"write:{report.file_name}"):
+                report.write()
+        print("CSV files have been created successfully.")
+
+        # 5. Only now, with every report safely on disk, count the primes in the q-range if asked to.
+        if args.prime_share:
+            with instrumentation.timer("prime_share"):
+                share = prime_share(unique_count, TWIN_PRIME_LIMIT, OFFSETS, args.start)
+            print(f"Unique primes produced: {unique_count} ({share * 100:.2f}% of all primes in the q-range)")
+    if SUMMARY_FILE is not None:
+        instrumentation.write_summary(SUMMARY_FILE)
+        print(f"Run summary written to '{SUMMARY_FILE}'.")
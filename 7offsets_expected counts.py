@@ -0,0 +1,33 @@
+import argparse
+
+from affine_forms import parse_forms
+from hardy_littlewood import write_expected_counts
+
+# --- Main script execution ---
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write the Hardy-Littlewood expected counts for the 7 offsets, without sieving.")
+    parser.add_argument("--start", type=int, default=0, help="count twin primes with p >= START (default: 0)")
+    parser.add_argument("--limit", "--end", dest="limit", type=int, default=1_000_000,
+                        help="upper limit for p (default: 1,000,000)")
+    parser.add_argument("--moduli", metavar="LIST", default="10", help="residue classes of p to split into (default: 10)")
+    parser.add_argument("--forms", metavar="LIST", help="comma-separated affine forms to use instead of the 7 offsets")
+    args = parser.parse_args()
+
+    # 1. Define the upper limit for twin prime search.
+    TWIN_PRIME_LIMIT = args.limit
+
+    # 2. Define the offsets to test.
+    OFFSETS = [1, 3, -3, -5, 7, 9, -9]
+    try:
+        if args.forms:
+            OFFSETS = parse_forms(args.forms)
+        MODULI = [int(modulus) for modulus in args.moduli.split(",") if modulus.strip()]
+    except ValueError as error:
+        parser.error(str(error))
+
+    # 3. Write the expected counts; only the singular series and an integral are evaluated.
+    file_name = "offset_expected_counts.csv"
+    print(f"Writing the expected counts for {args.start} <= p < {TWIN_PRIME_LIMIT} to '{file_name}'...")
+    write_expected_counts(file_name, OFFSETS, TWIN_PRIME_LIMIT, args.start, MODULI)
+    print("CSV file has been created successfully.")
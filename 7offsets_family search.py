@@ -0,0 +1,45 @@
+import argparse
+
+from offset_analysis import run_offset_pipeline
+from offset_reports import FamilySearchReport
+from offset_search import SCORES, family_count
+from results_store import ResultsStore, run_incremental
+
+# --- Main script execution ---
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rank every family of offsets drawn from a pool of odd offsets.")
+    parser.add_argument("--limit", type=int, default=1_000_000, help="upper limit for p (default: 1,000,000)")
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes (default: 1)")
+    parser.add_argument("--min-offset", type=int, default=-31, help="smallest offset in the pool (default: -31)")
+    parser.add_argument("--max-offset", type=int, default=31, help="largest offset in the pool (default: 31)")
+    parser.add_argument("--size", type=int, default=7, help="number of offsets per family (default: 7)")
+    parser.add_argument("--top", type=int, default=20, help="number of families to report (default: 20)")
+    parser.add_argument("--rank-by", choices=SCORES, default="unique", help="score to rank families by (default: unique)")
+    parser.add_argument("--store", metavar="DIR", help="reuse and extend the pool results stored in DIR")
+    args = parser.parse_args()
+
+    # 1. Define the upper limit for twin prime search.
+    TWIN_PRIME_LIMIT = args.limit
+
+    # 2. Define the pool of candidate offsets: every odd offset in the range.
+    OFFSETS = [offset for offset in range(args.min_offset, args.max_offset + 1) if offset % 2 == 1]
+    if not 1 <= len(OFFSETS) <= 64:
+        parser.error("the pool must hold between 1 and 64 odd offsets")
+    if not 1 <= args.size <= len(OFFSETS):
+        parser.error(f"--size must be between 1 and the pool size {len(OFFSETS)}")
+
+    # 3. Evaluate the whole pool once per twin prime.
+    print(f"Finding twin primes with p < {TWIN_PRIME_LIMIT} and evaluating a pool of {len(OFFSETS)} offsets...")
+    report = FamilySearchReport(OFFSETS, args.size, args.top, args.rank_by)
+    if args.store:
+        run_incremental(ResultsStore(args.store), TWIN_PRIME_LIMIT, OFFSETS, [report], args.workers)
+    else:
+        run_offset_pipeline(TWIN_PRIME_LIMIT, OFFSETS, [report], args.workers)
+    print(f"Total twin prime pairs considered: {report.twin_count}")
+    print("-" * 50)
+
+    # 4. Score every family from the pool masks and write the best ones to a CSV file.
+    print(f"Ranking {family_count(len(OFFSETS), args.size)} families and writing the best to '{report.file_name}'...")
+    report.write()
+    print("CSV file has been created successfully.")
@@ -0,0 +1,82 @@
+import re
+from collections import namedtuple
+
+# An affine form q = a * p + b, or q = a * (p + 2) + b when applied to the
+# partner p + 2 of the twin prime pair. A plain integer offset b is shorthand
+# for the form 2p + b used throughout the 7-offset analysis.
+AffineForm = namedtuple("AffineForm", ["a", "b", "partner"], defaults=[False])
+
+_FORM_PATTERN = re.compile(r"^(\d*)\*?(p|\(p\+2\))([+-]\d+)?$")
+
+
+def as_form(offset):
+    """
+    Returns the AffineForm for an offset: forms are passed through and an integer b becomes 2p + b.
+    """
+    if isinstance(offset, AffineForm):
+        return offset
+    return AffineForm(2, int(offset))
+
+
+def coefficients(offset):
+    """
+    Returns (a, b) such that the offset's q-value is a * p + b.
+    """
+    form = as_form(offset)
+    return form.a, form.b + 2 * form.a * form.partner
+
+
+def form_label(offset):
+    """
+    Returns the display label of an offset or form, e.g. "2p+1", "2p-3" or "3(p+2)+1".
+    """
+    form = as_form(offset)
+    multiplier = "" if form.a == 1 else str(form.a)
+    term = "(p+2)" if form.partner else "p"
+    return f"{multiplier}{term}{form.b:+d}" if form.b else f"{multiplier}{term}"
+
+
+def parse_form(text):
+    """
+    Parses a form written like "2p+1", "3p-7", "p+6" or "2(p+2)-3".
+    Raises ValueError for anything else.
+    """
+    match = _FORM_PATTERN.match(text.replace(" ", ""))
+    if not match:
+        raise ValueError(f"cannot parse affine form '{text}' (expected e.g. 2p+1 or 2(p+2)-3)")
+    a = int(match.group(1)) if match.group(1) else 1
+    if a < 1:
+        raise ValueError(f"affine form '{text}' needs a positive multiplier")
+    return AffineForm(a, int(match.group(3) or 0), match.group(2) != "p")
+
+
+def parse_forms(text, both_members=False):
+    """
+    Parses a comma-separated list of forms. With both_members, every form is
+    also applied to the partner p + 2.
+    """
+    forms = [parse_form(part) for part in text.split(",") if part.strip()]
+    if both_members:
+        forms += [form._replace(partner=True) for form in forms if not form.partner]
+    return forms
+
+
+def parse_offsets(text):
+    """
+    Parses a comma-separated list mixing plain offsets ("1,-3") and forms ("3p-2").
+    Raises ValueError for anything else.
+    """
+    return [int(part) if part.strip().lstrip("+-").isdigit() else parse_form(part) for part in text.split(",") if part.strip()]
+
+
+def multiplier_ranges(offsets):
+    """
+    Groups the offsets by multiplier. Returns a dict a -> (smallest b, largest b),
+    which bounds the q-window needed for each multiplier.
+    """
+    ranges = {}
+    for offset in offsets:
+        a, b = coefficients(offset)
+        low, high = ranges.get(a, (b, b))
+        ranges[a] = (min(low, b), max(high, b))
+    return ranges
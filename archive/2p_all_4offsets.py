@@ -1,16 +1,23 @@
-from sympy import isprime, primerange
+import argparse
+import os
+import sys
+
+# The shared prime module lives one directory up.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from prime_sieve import find_twin_primes, is_prime, prime_flags, sympy_cross_check
 from collections import defaultdict
 
-def twin_primes(limit):
+def twin_primes(limit, flags=None):
     """
     Generates twin prime pairs up to a given limit.
     A twin prime pair is a pair of primes (p, p+2).
     """
-    # Generate all primes up to the limit using primerange
-    primes = list(primerange(2, limit))
+    # One sieve of Eratosthenes (shared with the offset tests when passed in)
+    # replaces sympy's primerange and isprime; every check is then a lookup.
+    flags = flags if flags is not None else prime_flags(limit)
 
-    # Filter for twin prime pairs
-    return [(p, p + 2) for p in primes if isprime(p + 2) and p + 2 <= limit]
+    # Keep the pairs with p + 2 <= limit, as before.
+    return [(p, p + 2) for p in find_twin_primes(limit - 1, flags)]
 
 def test_conjecture_quad_offsets(limit=1_000_000):
     """
@@ -23,8 +30,11 @@ def test_conjecture_quad_offsets(limit=1_000_000):
 
     The results are categorized by the last digits of the twin prime pairs.
     """
+    # Sieve once up to the largest q-value (at most 2p + 7) and look everything up in it.
+    flags = prime_flags(2 * limit + 7)
+
     # Get all twin prime pairs within the limit
-    pairs = twin_primes(limit)
+    pairs = twin_primes(limit, flags)
 
     # Use defaultdict to simplify the initialization of nested dictionaries
     results = defaultdict(lambda: {
@@ -70,10 +80,10 @@ def test_conjecture_quad_offsets(limit=1_000_000):
         q4 = 2 * p + 3
 
         # Check primality for all four offsets
-        is_q1_prime = isprime(q1)
-        is_q2_prime = isprime(q2)
-        is_q3_prime = isprime(q3)
-        is_q4_prime = isprime(q4)
+        is_q1_prime = is_prime(q1, flags)
+        is_q2_prime = is_prime(q2, flags)
+        is_q3_prime = is_prime(q3, flags)
+        is_q4_prime = is_prime(q4, flags)
         
         # Count how many of the four are prime
         prime_count = is_q1_prime + is_q2_prime + is_q3_prime + is_q4_prime
@@ -96,8 +106,17 @@ def test_conjecture_quad_offsets(limit=1_000_000):
     return results
 
 if __name__ == "__main__":
+    limit = 1_000_000
+    parser = argparse.ArgumentParser(description="For the twin primes p < 1,000,000, count how many of 2p+1, 2p+7, 2p-3 and 2p+3 are prime, by the last digits of the pair.")
+    parser.add_argument("--check-sympy", action="store_true",
+                        help="first cross-check the sieve against sympy (validation only; needs sympy)")
+    args = parser.parse_args()
+    if args.check_sympy:
+        mismatches = sympy_cross_check(2 * limit + 7)
+        print("Sieve agrees with sympy." if not mismatches else f"Sieve disagrees with sympy at {mismatches[:10]}")
+
     # Run the test with the default limit of 1,000,000
-    conjecture_results = test_conjecture_quad_offsets()
+    conjecture_results = test_conjecture_quad_offsets(limit)
 
     # Print the results in a structured format
     print(f"Twin Prime Conjecture Test with Four Offsets (up to 1,000,000):")
@@ -1,18 +1,22 @@
-from sympy import isprime, primerange
+import argparse
+import os
+import sys
 
-def twin_primes(limit):
+# The shared prime module lives one directory up.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from prime_sieve import find_twin_primes, is_prime, prime_flags, sympy_cross_check
+
+def twin_primes(limit, flags=None):
     """
     Generates twin prime pairs up to a given limit.
     A twin prime pair is a pair of primes (p, p+2).
     """
-    # Generate all primes up to the limit
-    # The primerange function from sympy is a very efficient way to get primes
-    primes = list(primerange(2, limit))
+    # One sieve of Eratosthenes (shared with the offset tests when passed in)
+    # replaces sympy's primerange and isprime; every check is then a lookup.
+    flags = flags if flags is not None else prime_flags(limit)
 
-    # Filter for twin prime pairs
-    # A pair (p, p+2) is a twin prime pair if both p and p+2 are prime
-    # and p+2 does not exceed the limit.
-    return [(p, p + 2) for p in primes if isprime(p + 2) and p + 2 <= limit]
+    # Keep the pairs with p + 2 <= limit, as before.
+    return [(p, p + 2) for p in find_twin_primes(limit - 1, flags)]
 
 def test_conjecture_v2(limit=1_000_000):
     """
@@ -22,8 +26,11 @@ def test_conjecture_v2(limit=1_000_000):
     
     The results are categorized by the last digits of the twin prime pairs.
     """
+    # Sieve once up to the largest q-value (at most 2p + 7) and look everything up in it.
+    flags = prime_flags(2 * limit + 7)
+
     # Get all twin prime pairs within the limit
-    pairs = twin_primes(limit)
+    pairs = twin_primes(limit, flags)
 
     # Initialize a nested dictionary to store the results, categorized by the last digits
     results = {
@@ -84,8 +91,8 @@ def test_conjecture_v2(limit=1_000_000):
         q2 = 2 * p + 7
 
         # Check if q1 and q2 are prime
-        is_q1_prime = isprime(q1)
-        is_q2_prime = isprime(q2)
+        is_q1_prime = is_prime(q1, flags)
+        is_q2_prime = is_prime(q2, flags)
 
         # Categorize the results based on primality of q1 and q2
         if is_q1_prime and is_q2_prime:
@@ -103,8 +110,17 @@ def test_conjecture_v2(limit=1_000_000):
     return results
 
 if __name__ == "__main__":
+    limit = 1_000_000
+    parser = argparse.ArgumentParser(description="For the twin primes p < 1,000,000, count how often 2p+1 and/or 2p+7 are prime, by the last digits of the pair.")
+    parser.add_argument("--check-sympy", action="store_true",
+                        help="first cross-check the sieve against sympy (validation only; needs sympy)")
+    args = parser.parse_args()
+    if args.check_sympy:
+        mismatches = sympy_cross_check(2 * limit + 7)
+        print("Sieve agrees with sympy." if not mismatches else f"Sieve disagrees with sympy at {mismatches[:10]}")
+
     # Run the test with the default limit of 1,000,000
-    conjecture_results = test_conjecture_v2()
+    conjecture_results = test_conjecture_v2(limit)
 
     # Print the results in a structured format
     print(f"Modified Conjecture Test Results (up to 1,000,000):")
@@ -1,23 +1,30 @@
-from sympy import isprime, primerange
+import argparse
+import os
+import sys
+
+# The shared prime module lives one directory up.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from prime_sieve import find_twin_primes, is_prime, prime_flags, sympy_cross_check
 from collections import defaultdict
 
-def twin_primes(limit):
+def twin_primes(limit, flags=None):
     """
     Generates twin prime pairs up to a given limit.
     A twin prime pair is a pair of primes (p, p+2).
     
     Args:
         limit (int): The upper limit for the twin prime pairs.
+        flags (bytearray): An optional sieve covering the limit, see prime_sieve.prime_flags.
     
     Returns:
         list: A list of twin prime pairs found.
     """
-    # Generate all primes up to the limit using primerange, which is very efficient.
-    primes = list(primerange(2, limit))
+    # One sieve of Eratosthenes (shared with the offset tests when passed in)
+    # replaces sympy's primerange and isprime; every check is then a lookup.
+    flags = flags if flags is not None else prime_flags(limit)
 
-    # Filter for twin prime pairs from the generated list of primes.
-    # The condition `p + 2 <= limit` ensures we don't exceed the boundary.
-    return [(p, p + 2) for p in primes if isprime(p + 2) and p + 2 <= limit]
+    # Keep the pairs with p + 2 <= limit, as before.
+    return [(p, p + 2) for p in find_twin_primes(limit - 1, flags)]
 
 def test_unique_primes_from_offsets(limit=1_000_000):
     """
@@ -38,8 +45,11 @@ def test_unique_primes_from_offsets(limit=1_000_000):
             - The number of unique primes found.
             - The total number of twin prime pairs considered.
     """
+    # Sieve once up to the largest q-value (at most 2p + 7) and look everything up in it.
+    flags = prime_flags(2 * limit + 7)
+
     # Get all twin prime pairs within the specified limit
-    pairs = twin_primes(limit)
+    pairs = twin_primes(limit, flags)
     
     # Initialize a set to store all unique prime numbers found.
     # A set is used because it automatically handles duplicates.
@@ -60,20 +70,29 @@ def test_unique_primes_from_offsets(limit=1_000_000):
 
         # Check each offset for primality and add to the set if it's a prime.
         # The set handles the uniqueness automatically.
-        if isprime(q1):
+        if is_prime(q1, flags):
             unique_primes_found.add(q1)
-        if isprime(q2):
+        if is_prime(q2, flags):
             unique_primes_found.add(q2)
-        if isprime(q3):
+        if is_prime(q3, flags):
             unique_primes_found.add(q3)
-        if isprime(q4):
+        if is_prime(q4, flags):
             unique_primes_found.add(q4)
             
     return len(unique_primes_found), len(pairs)
 
 if __name__ == "__main__":
+    limit = 1_000_000
+    parser = argparse.ArgumentParser(description="Count the distinct primes that 2p+1, 2p+7, 2p-3 and 2p+3 produce over the twin primes p < 1,000,000.")
+    parser.add_argument("--check-sympy", action="store_true",
+                        help="first cross-check the sieve against sympy (validation only; needs sympy)")
+    args = parser.parse_args()
+    if args.check_sympy:
+        mismatches = sympy_cross_check(2 * limit + 7)
+        print("Sieve agrees with sympy." if not mismatches else f"Sieve disagrees with sympy at {mismatches[:10]}")
+
     # Run the test with the default limit of 1,000,000
-    number_of_unique_primes, total_pairs = test_unique_primes_from_offsets()
+    number_of_unique_primes, total_pairs = test_unique_primes_from_offsets(limit)
 
     # Print the results
     print(f"Twin Prime Conjecture Test with Four Offsets (up to 1,000,000):")
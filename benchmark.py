@@ -0,0 +1,328 @@
+import argparse
+import asyncio
+import csv
+import json
+import multiprocessing
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from instrumentation import peak_rss
+from miller_rabin import is_prime_mr
+from offset_analysis import (OffsetBatch, load_checkpoint, offset_matrix, offset_primes, run_offset_pipeline,
+                             save_checkpoint, success_counts, success_masks)
+from offset_reports import (AllPrimesReport, LastDigitReport, ResidueClassReport, SuccessDistributionReport,
+                            TwinIndexReport)
+from offset_table import load_offset_table, write_offset_table, write_table_csv
+from prime_sieve import find_twin_primes_in_range, is_prime, iter_twin_prime_segments
+from query_service import OffsetQueries, QueryServer
+from twin_index import TwinIndex
+
+# Benchmark harness for the pipeline stages.
+#
+# Every (stage, limit) measurement runs in a fresh process, so its peak RSS is
+# its own. Results go to a JSON file; given a baseline file from an earlier run,
+# any stage that got slower by more than the tolerance is flagged. The archived
+# 10^6 CSVs are checked first as correctness oracles, along with the edge cases
+# of check_edge_cases.
+
+OFFSETS = [1, 3, -3, -5, 7, 9, -9]
+LIMITS = [10 ** 5, 10 ** 6, 10 ** 7, 10 ** 8, 10 ** 9]
+STAGES = ("is_prime", "find_twin_primes", "high_window", "offset_evaluation", "aggregation", "csv_export")
+
+# The high_window stage finds the twin primes in a window this wide, starting at
+# this multiple of the limit (10^16 at 10^9): a narrow window with many base primes.
+HIGH_WINDOW_WIDTH = 10 ** 5
+HIGH_WINDOW_SCALE = 10 ** 7
+
+# Slowdowns smaller than this many seconds are timer noise, whatever the ratio.
+MIN_REGRESSION_SECONDS = 0.01
+
+# Numbers tested per is_prime measurement, drawn from just below the largest q-value.
+IS_PRIME_SAMPLE = 20_000
+
+# Strong pseudoprimes to the first 12 and 11 prime bases, which Miller-Rabin must reject.
+KNOWN_COMPOSITES = (318665857834031151167461, 3825123056546413051)
+
+ARCHIVE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "archive")
+
+
+def _evaluated_batches(limit):
+    for segment in iter_twin_prime_segments(limit, OFFSETS):
+        p = np.asarray(segment.twin_ps, dtype=np.int64)
+        matrix = offset_matrix(p, OFFSETS, segment.q_windows)
+        yield OffsetBatch(p, OFFSETS, matrix, offset_primes(p, OFFSETS, matrix), np.asarray(segment.residues, dtype=np.uint8))
+
+
+def _stage_is_prime(limit, output_dir):
+    rng = random.Random(limit)
+    top = 2 * limit + max(OFFSETS)
+    sample = [rng.randrange(max(top - 10 * IS_PRIME_SAMPLE, 2), top) | 1 for _ in range(IS_PRIME_SAMPLE)]
+    start = time.perf_counter()
+    for n in sample:
+        is_prime(n)
+    return time.perf_counter() - start, {'q_tests': len(sample)}
+
+
+def _stage_find_twin_primes(limit, output_dir):
+    start = time.perf_counter()
+    pairs = len(find_twin_primes_in_range(0, limit))
+    return time.perf_counter() - start, {'pairs': pairs}
+
+
+def _stage_high_window(limit, output_dir):
+    low = HIGH_WINDOW_SCALE * limit
+    start = time.perf_counter()
+    pairs = len(find_twin_primes_in_range(low, low + HIGH_WINDOW_WIDTH))
+    return time.perf_counter() - start, {'pairs': pairs}
+
+
+def _stage_offset_evaluation(limit, output_dir):
+    start = time.perf_counter()
+    pairs = sum(len(batch.p) for batch in _evaluated_batches(limit))
+    return time.perf_counter() - start, {'pairs': pairs, 'q_tests': pairs * len(OFFSETS)}
+
+
+def _stage_aggregation(limit, output_dir):
+    batches = list(_evaluated_batches(limit))
+    reports = [SuccessDistributionReport(OFFSETS), LastDigitReport(OFFSETS), ResidueClassReport(OFFSETS)]
+    start = time.perf_counter()
+    for batch in batches:
+        for report in reports:
+            report.update(batch)
+    return time.perf_counter() - start, {'pairs': reports[0].twin_count}
+
+
+def _stage_csv_export(limit, output_dir):
+    report = AllPrimesReport(OFFSETS, spill_dir=output_dir)
+    for batch in _evaluated_batches(limit):
+        report.update(batch)
+    file_name = os.path.join(output_dir, report.file_name)
+    start = time.perf_counter()
+    report.write(file_name)
+    return time.perf_counter() - start, {'pairs': report.twin_count, 'output_bytes': os.path.getsize(file_name)}
+
+
+_STAGE_FUNCTIONS = {
+    "is_prime": _stage_is_prime,
+    "find_twin_primes": _stage_find_twin_primes,
+    "high_window": _stage_high_window,
+    "offset_evaluation": _stage_offset_evaluation,
+    "aggregation": _stage_aggregation,
+    "csv_export": _stage_csv_export,
+}
+
+
+def _measure(stage, limit):
+    # Runs in its own process: time the stage, then report the process's peak RSS.
+    with tempfile.TemporaryDirectory(prefix="twin_prime_benchmark_") as output_dir:
+        seconds, counts = _STAGE_FUNCTIONS[stage](limit, output_dir)
+    return seconds, counts, peak_rss()
+
+
+def run_stage(stage, limit, repeat=1):
+    """
+    Measures one stage at one limit, each repetition in a fresh process.
+    Returns a result record with the best time, the throughputs derived from it,
+    the peak RSS and the bytes written.
+    """
+    best = None
+    for _ in range(repeat):
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+            seconds, counts, peak_rss = pool.submit(_measure, stage, limit).result()
+        if best is None or seconds < best[0]:
+            best = (seconds, counts, peak_rss)
+    seconds, counts, peak_rss = best
+    record = {'stage': stage, 'limit': limit, 'seconds': seconds, 'peak_rss_bytes': peak_rss,
+              'pairs': counts.get('pairs'), 'q_tests': counts.get('q_tests'), 'output_bytes': counts.get('output_bytes')}
+    record['pairs_per_second'] = record['pairs'] / seconds if record['pairs'] and seconds > 0 else None
+    record['q_tests_per_second'] = record['q_tests'] / seconds if record['q_tests'] and seconds > 0 else None
+    return record
+
+
+def check_oracles():
+    """
+    Checks the offset evaluation against the archived 10^6 results, and
+    Miller-Rabin against known strong pseudoprimes. Returns a list of
+    (file name, problem) for every mismatch found.
+    """
+    problems = [("miller_rabin.py", f"{n} is composite but passes") for n in KNOWN_COMPOSITES if is_prime_mr(n)]
+
+    # twin_prime_offsets_v2.csv: one row per twin prime, one is_prime column per odd offset from -9 to 9.
+    file_name = "twin_prime_offsets_v2.csv"
+    with open(os.path.join(ARCHIVE, file_name), newline='') as csvfile:
+        rows = list(csv.DictReader(csvfile))
+    offsets = list(range(-9, 10, 2))
+    p = np.array([int(row['p']) for row in rows], dtype=np.int64)
+    expected = np.array([[row[f"2p{offset:+d}_is_prime"] == "True" for offset in offsets] for row in rows])
+    evaluated = [(np.asarray(segment.twin_ps, dtype=np.int64), segment.q_windows)
+                 for segment in iter_twin_prime_segments(int(p[-1]) + 1, offsets)]
+    twin_ps = np.concatenate([twin_ps for twin_ps, _ in evaluated])
+    if not np.array_equal(twin_ps, p):
+        problems.append((file_name, "twin primes differ"))
+    else:
+        matrix = np.concatenate([offset_matrix(twin_ps, offsets, q_windows) for twin_ps, q_windows in evaluated])
+        if not np.array_equal(matrix, expected):
+            problems.append((file_name, f"{int((matrix != expected).any(axis=1).sum())} rows differ"))
+        elif matrix.sum(axis=1).tolist() != [int(row['success_count']) for row in rows]:
+            problems.append((file_name, "success counts differ"))
+        else:
+            # The same rows stored as a columnar main table must export back to the archived CSV.
+            with tempfile.TemporaryDirectory(prefix="twin_prime_benchmark_") as output_dir:
+                table_file, csv_file = os.path.join(output_dir, "main_table.bin"), os.path.join(output_dir, file_name)
+                write_offset_table(table_file, offsets, [twin_ps], [success_masks(matrix)])
+                write_table_csv(csv_file, load_offset_table(table_file))
+                with open(csv_file, newline='') as csvfile:
+                    exported = list(csv.DictReader(csvfile))
+            if exported != rows:
+                differing = sum(exported_row != row for exported_row, row in zip(exported, rows)) + abs(len(exported) - len(rows))
+                problems.append((file_name, f"{differing} rows differ once exported from the main table"))
+
+    # summary_results_4offsets.csv: the distribution for 2p+1, 2p+7, 2p-3 and 2p+3,
+    # over p < 10^6 without (3, 5) and (5, 7).
+    file_name = "summary_results_4offsets.csv"
+    with open(os.path.join(ARCHIVE, file_name), newline='') as csvfile:
+        row = next(csv.DictReader(csvfile))
+    offsets = [1, 7, -3, 3]
+    matrix = np.concatenate([offset_matrix(np.asarray(segment.twin_ps[2 if segment.low == 0 else 0:], dtype=np.int64),
+                                           offsets, segment.q_windows)
+                             for segment in iter_twin_prime_segments(10 ** 6, offsets)])
+    exact = success_counts(matrix)
+    found = {
+        'total_pairs': len(matrix),
+        'four_primes_found': exact[4], 'three_primes_found': exact[3], 'two_primes_found': exact[2],
+        'one_prime_found': exact[1], 'no_primes_found': exact[0], 'at_least_one_prime_found': len(matrix) - exact[0],
+    }
+    for column, count in found.items():
+        if int(row[column]) != int(count):
+            problems.append((file_name, f"{column} is {int(count)}, archived {row[column]}"))
+    return problems
+
+
+def check_edge_cases():
+    """
+    Runs the edge cases earlier bugs were found at (each must fail cleanly or
+    give the right answer) and returns a list of (file name, problem) for
+    every one that does not.
+    """
+    problems = []
+    with tempfile.TemporaryDirectory(prefix="twin_prime_benchmark_") as output_dir:
+        index_file = os.path.join(output_dir, TwinIndexReport.file_name)
+        run_offset_pipeline(1000, OFFSETS, [TwinIndexReport(OFFSETS)])[0].write(index_file)
+        server = QueryServer(OffsetQueries(index_file))
+
+        # q = 2p + 9 overflows int64 at p = 2^62 + 1 and must be refused, not wrapped.
+        status, payload = asyncio.run(server.answer("/primality", {'p': str(2 ** 62 + 1)}))
+        if status != 400:
+            problems.append(("query_service.py", f"/primality?p=2^62+1 answered {status}: {payload}"))
+
+        # A bad /batch entry gets an error in its place, keeping the results aligned with the queries.
+        status, payload = asyncio.run(server._batch(json.dumps([1, {'path': "/rank", 'params': {'x': 1000}}]).encode()))
+        if [entry.get('status') for entry in payload] != [400, 200]:
+            problems.append(("query_service.py", f"/batch with a bad first entry answered {payload}"))
+
+        # A window without twin primes must still write an index that opens.
+        empty_file = os.path.join(output_dir, "empty_" + TwinIndexReport.file_name)
+        run_offset_pipeline(220, OFFSETS, [TwinIndexReport(OFFSETS)], start=200)[0].write(empty_file)
+        try:
+            empty = TwinIndex(empty_file)
+            if len(empty) or empty.rank(10 ** 6) or empty.pairs(0, 10 ** 6)[0].size:
+                problems.append(("twin_index.py", "the index of an empty window is not empty"))
+        except ValueError as error:
+            problems.append(("twin_index.py", f"the index of an empty window does not open: {error}"))
+
+        # A checkpoint resumes only the run it was written for, down to the report parameters.
+        checkpoint = os.path.join(output_dir, "checkpoint.pkl")
+        save_checkpoint(checkpoint, 0, 1000, OFFSETS, 500, [ResidueClassReport(OFFSETS, (10,))])
+        for start, moduli in ((100, (10,)), (0, (10, 30))):
+            try:
+                load_checkpoint(checkpoint, start, 1000, OFFSETS, [ResidueClassReport(OFFSETS, moduli)])
+                problems.append(("offset_analysis.py", f"a checkpoint resumed a run with start={start}, moduli={moduli}"))
+            except ValueError:
+                pass
+        if load_checkpoint(checkpoint, 0, 1000, OFFSETS, [ResidueClassReport(OFFSETS, (10,))]) != 500:
+            problems.append(("offset_analysis.py", "a checkpoint does not resume its own run"))
+    return problems
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    """
+    Returns the records of `results` whose time exceeds the baseline's time for
+    the same stage and limit by more than `tolerance` (a fraction) and by at
+    least MIN_REGRESSION_SECONDS, each with the baseline time and the slowdown added.
+    """
+    baseline_times = {(record['stage'], record['limit']): record['seconds'] for record in baseline['results']}
+    regressions = []
+    for record in results:
+        before = baseline_times.get((record['stage'], record['limit']))
+        if before and record['seconds'] > max(before * (1 + tolerance), before + MIN_REGRESSION_SECONDS):
+            regressions.append(dict(record, baseline_seconds=before, slowdown=record['seconds'] / before))
+    return regressions
+
+
+def _format_rate(rate):
+    return f"{rate:,.0f}/s" if rate else "-"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time each pipeline stage and compare against a stored baseline.")
+    parser.add_argument("--limits", default=",".join(str(limit) for limit in LIMITS),
+                        help="comma-separated limits to benchmark (default: 10^5 through 10^9)")
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"comma-separated stages (default: {','.join(STAGES)})")
+    parser.add_argument("--repeat", type=int, default=1, help="repetitions per measurement; the best time is kept (default: 1)")
+    parser.add_argument("--output", default="benchmark_results.json", help="results file (default: benchmark_results.json)")
+    parser.add_argument("--baseline", metavar="FILE", help="results file of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="slowdown flagged as a regression (default: 0.10)")
+    parser.add_argument("--skip-oracles", action="store_true",
+                        help="do not check the archived 10^6 results and the edge cases first")
+    args = parser.parse_args()
+    limits = [int(float(limit)) for limit in args.limits.split(",")]
+    stages = args.stages.split(",")
+    if any(stage not in STAGES for stage in stages):
+        parser.error(f"--stages must be drawn from {', '.join(STAGES)}")
+
+    # 1. Check the evaluation against the archived results.
+    problems = []
+    if not args.skip_oracles:
+        print("Checking against the archived 10^6 results and known edge cases...")
+        problems = check_oracles() + check_edge_cases()
+        for file_name, problem in problems:
+            print(f"  MISMATCH {file_name}: {problem}")
+        print("  all oracles match" if not problems else f"  {len(problems)} mismatches")
+
+    # 2. Time every stage at every limit.
+    results = []
+    for limit in limits:
+        for stage in stages:
+            record = run_stage(stage, limit, args.repeat)
+            results.append(record)
+            rss = f"{record['peak_rss_bytes'] / 2 ** 20:.0f} MiB" if record['peak_rss_bytes'] else "-"
+            print(f"{stage:>18} {limit:>14,} {record['seconds']:10.3f} s  pairs {_format_rate(record['pairs_per_second']):>16}"
+                  f"  q-tests {_format_rate(record['q_tests_per_second']):>16}  peak RSS {rss}")
+
+    # 3. Save the results and flag regressions against the baseline.
+    summary = {
+        'created': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'python': sys.version.split()[0], 'numpy': np.__version__, 'platform': platform.platform(),
+        'oracle_problems': [f"{file_name}: {problem}" for file_name, problem in problems],
+        'results': results,
+    }
+    with open(args.output, 'w') as results_file:
+        json.dump(summary, results_file, indent=2)
+    print(f"Results written to '{args.output}'.")
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare_to_baseline(results, json.load(baseline_file), args.tolerance)
+        for record in regressions:
+            print(f"REGRESSION {record['stage']} at {record['limit']:,}: {record['seconds']:.3f} s "
+                  f"vs {record['baseline_seconds']:.3f} s ({record['slowdown']:.2f}x)")
+        print("No regressions." if not regressions else f"{len(regressions)} regressions.")
+    sys.exit(1 if problems or regressions else 0)
@@ -1,23 +1,7 @@
-def is_prime(n):
-    if n < 2:
-        return False
-    if n == 2 or n == 3:
-        return True
-    if n % 2 == 0 or n % 3 == 0:
-        return False
-    i = 5
-    while i * i <= n:
-        if n % i == 0 or n % (i + 2) == 0:
-            return False
-        i += 6
-    return True
+from prime_sieve import find_twin_primes
 
 def twin_primes(limit):
-    twins = []
-    for p in range(3, limit, 2):
-        if is_prime(p) and is_prime(p + 2):
-            twins.append((p, p + 2))
-    return twins
+    return [(p, p + 2) for p in find_twin_primes(limit)]
 
 # Example: twin primes under 1000
 twin_list = twin_primes(1000)
@@ -0,0 +1,192 @@
+import csv
+import math
+
+import numpy as np
+
+from affine_forms import coefficients
+from offset_analysis import offset_label
+from prime_sieve import small_primes
+
+# Expected counts from the Hardy-Littlewood (Bateman-Horn) conjecture.
+#
+# A tuple of linear forms a * n + b, here (p, p + 2, a * p + b), is expected to be
+# simultaneously prime for about
+#     C * integral of dt / (log t * log(t + 2) * log(a * t + b))
+# values of n below x, where the singular series
+#     C = prod over primes l of (1 - w(l) / l) / (1 - 1 / l) ** k
+# corrects for divisibility: w(l) is the number of residues n mod l at which one of
+# the k forms is divisible by l. For the twin pair alone C = 2 * C2 = 1.3203...
+
+# The Euler product is taken over the primes up to this bound; its tail changes
+# the result by less than one part in a million.
+SERIES_PRIME_LIMIT = 1 << 20
+
+TWIN_FORMS = ((1, 0), (1, 2))
+
+_series_cache = {}
+
+
+def offset_forms(offset):
+    """
+    Returns the linear forms of the tuple (p, p + 2, q) for an offset or affine form.
+    """
+    return TWIN_FORMS + (coefficients(offset),)
+
+
+def distinct_forms(forms):
+    """
+    Returns the tuple of forms without repeats, or None if two different forms
+    are proportional (e.g. p + 2 and 3p + 6): those are both prime for finitely
+    many n at most, so such a tuple has no expected count.
+    """
+    distinct = tuple(dict.fromkeys(forms))
+    for index, (a1, b1) in enumerate(distinct):
+        for a2, b2 in distinct[index + 1:]:
+            if a1 * b2 == a2 * b1:
+                return None
+    return distinct
+
+
+def _root_residues(forms, prime):
+    """
+    Returns the set of residues n mod prime at which one of the forms is
+    divisible by prime (each form a * n + b has the single root -b / a, unless
+    prime divides a), or None if one of them is divisible at every n.
+    """
+    roots = set()
+    for a, b in forms:
+        if a % prime:
+            roots.add(-b * pow(a, -1, prime) % prime)
+        elif b % prime == 0:
+            return None
+    return roots
+
+
+def _roots(forms, prime):
+    """
+    Returns the residues n mod prime at which one of the forms is divisible by prime,
+    as a boolean array of length prime.
+    """
+    roots = _root_residues(forms, prime)
+    divisible = np.full(prime, roots is None)
+    if roots:
+        divisible[list(roots)] = True
+    return divisible
+
+
+def singular_series(forms, prime_limit=SERIES_PRIME_LIMIT):
+    """
+    Returns the singular series of a tuple of linear forms (a, b), or 0 if some
+    prime always divides one of them or two of them are proportional (the tuple
+    is inadmissible). Repeated forms count once. Cached per tuple of forms.
+    """
+    key = (tuple(forms), prime_limit)
+    forms = distinct_forms(forms)
+    if forms is None:
+        _series_cache[key] = 0.0
+    if key not in _series_cache:
+        primes = np.array(small_primes(prime_limit), dtype=np.int64)
+        # w(l) is counted root by root for the primes that divide a coefficient,
+        # and is k minus the number of coinciding roots for every other prime.
+        # (Two forms share their root mod l exactly when l divides a1 * b2 - a2 * b1,
+        # which is never 0 for distinct, non-proportional forms.)
+        special = primes <= len(forms)
+        for a1, b1 in forms:
+            special |= a1 % primes == 0
+            for a2, b2 in forms:
+                if (a1, b1) < (a2, b2):
+                    special |= (a1 * b2 - a2 * b1) % primes == 0
+        omega = np.full(len(primes), len(forms), dtype=np.float64)
+        omega[special] = [prime if roots is None else len(roots)
+                          for prime in primes[special].tolist() for roots in [_root_residues(forms, prime)]]
+
+        if np.any(omega == primes):
+            _series_cache[key] = 0.0
+        else:
+            factors = np.log1p(-omega / primes) - len(forms) * np.log1p(-1 / primes)
+            _series_cache[key] = float(np.exp(factors.sum()))
+    return _series_cache[key]
+
+
+def log_integral(forms, low, high, points=1 << 12):
+    """
+    Returns the integral of 1 / prod(log(a * t + b)) for t in [low, high) by
+    Simpson's rule in log t. The integrand is only meaningful once every form
+    exceeds e, so the integral starts there at the earliest.
+    """
+    low = max(low, 3, *[(math.e - b) / a for a, b in forms])
+    if high <= low:
+        return 0.0
+    u = np.linspace(math.log(low), math.log(high), points + 1)
+    t = np.exp(u)
+    integrand = t / np.prod([np.log(a * t + b) for a, b in forms], axis=0)
+    step = (u[-1] - u[0]) / points
+    weights = np.ones(points + 1)
+    weights[1:-1:2], weights[2:-1:2] = 4, 2
+    return float(step / 3 * (weights @ integrand))
+
+
+def expected_count(forms, limit, start=0):
+    """
+    Returns the expected number of n with start <= n < limit at which all the forms are prime.
+    """
+    series = singular_series(forms)
+    return series * log_integral(distinct_forms(forms), start, limit) if series else 0.0
+
+
+def residue_shares(forms, modulus):
+    """
+    Splits an expected count across the residue classes n mod modulus.
+    Returns an array where entry r is the share of the count with n = r (mod modulus);
+    classes where a form is always divisible by a prime factor of the modulus get 0.
+    """
+    residues = np.arange(modulus)
+    shares = np.full(modulus, 1 / modulus)
+    for prime in small_primes(modulus):
+        if modulus % prime == 0:
+            roots = _roots(forms, prime)
+            if roots.all():
+                return np.zeros(modulus)
+            shares *= np.where(roots[residues % prime], 0.0, prime / (prime - np.count_nonzero(roots)))
+    return shares
+
+
+def write_expected_counts(file_name, offsets, limit, start=0, moduli=(), observed=None):
+    """
+    Writes the expected count of twin primes and of each (p, p + 2, q) tuple,
+    overall and per residue class of p for each modulus. With `observed`
+    (a HardyLittlewoodReport, or anything with its twin_count, totals, pairs
+    and successes) the observed counts and their ratio to the expectation
+    are written alongside.
+    """
+    tuples = [("(p, p+2)", TWIN_FORMS)] + [(f"(p, p+2, {offset_label(offset)})", offset_forms(offset)) for offset in offsets]
+    if observed is not None:
+        observed_counts = [observed.twin_count] + observed.totals.tolist()
+
+    with open(file_name, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow([f"Hardy-Littlewood expected counts for {start} <= p < {limit}", "", "", "", ""])
+        writer.writerow(["Tuple", "Singular series", "Expected", "Observed", "Observed / expected"])
+        expected = []
+        for index, (label, forms) in enumerate(tuples):
+            expected.append(expected_count(forms, limit, start))
+            row = [label, f"{singular_series(forms):.6f}", f"{expected[-1]:.1f}"]
+            if observed is not None:
+                count = int(observed_counts[index])
+                row += [count, f"{count / expected[-1]:.4f}" if expected[-1] else ""]
+            writer.writerow(row + [""] * (5 - len(row)))
+
+        for modulus in moduli:
+            writer.writerow(["", "", "", "", ""]) # Blank row for separation
+            writer.writerow([f"Residue classes of p mod {modulus}", "Residue", "Expected", "Observed", "Observed / expected"])
+            for index, (label, forms) in enumerate(tuples):
+                shares = residue_shares(forms, modulus) * expected[index]
+                if observed is not None:
+                    counts = observed.pairs[modulus] if index == 0 else observed.successes[modulus][:, index - 1]
+                # Only classes that can hold the tuple (or did) are listed.
+                for residue in np.flatnonzero(shares if observed is None else shares + counts).tolist():
+                    row = [label, residue, f"{shares[residue]:.1f}"]
+                    if observed is not None:
+                        count = int(counts[residue])
+                        row += [count, f"{count / shares[residue]:.4f}" if shares[residue] else ""]
+                    writer.writerow(row + [""] * (5 - len(row)))
@@ -0,0 +1,232 @@
+import json
+import os
+import sys
+import time
+from contextlib import nullcontext
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+# Optional timing, counting and progress reporting for long runs.
+#
+# The pipeline calls instrumentation.timer(name) around each stage (sieving,
+# twin detection, offset tests, report updates, writes), count(name, amount)
+# for pairs and q-tests, and progress(done) after each segment. By default it
+# gets NO_INSTRUMENTATION, whose methods do nothing and whose timer is one
+# shared null context, so an uninstrumented run pays a few calls per segment.
+# With several workers each shard times itself, so the stage times add up
+# across processes and can exceed the wall time.
+
+# Seconds between live progress lines.
+PROGRESS_INTERVAL = 5.0
+
+# Allocation sites listed in the summary when memory tracing is on.
+TRACEMALLOC_TOP = 10
+
+
+def current_rss():
+    """
+    Returns the resident set size of this process in bytes (the peak if the
+    current value is not available on this platform), or None.
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    return peak_rss()
+
+
+def peak_rss():
+    """
+    Returns the peak resident set size of this process in bytes, or None if
+    the platform does not report it.
+    """
+    if resource is None:
+        return None
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere.
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def _format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+
+class _Timer:
+    __slots__ = ("timings", "name", "started")
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        entry = self.timings.setdefault(self.name, [0.0, 0])
+        entry[0] += time.perf_counter() - self.started
+        entry[1] += 1
+
+
+class Instrumentation:
+    """
+    Collects per-stage timers and counters for a run, prints live progress
+    (pairs/s, q-tests/s, ETA and RSS) if asked to, and can profile the run with
+    cProfile and tracemalloc while it is active as a context manager.
+    Shard copies from fresh() are merged back like reports.
+    """
+
+    enabled = True
+
+    def __init__(self, progress=False, profile_file=None, trace_memory=False, stream=None):
+        self.show_progress = progress
+        self.profile_file = profile_file
+        self.trace_memory = trace_memory
+        self.stream = stream
+        self.timings = {}
+        self.counters = {}
+        self.start = self.limit = 0
+        self.started = time.perf_counter()
+        self.last_progress = self.started
+        self.elapsed = None
+        self.memory = None
+        self._profiler = None
+
+    def __getstate__(self):
+        # Shard copies travel between processes without the profiler or the stream.
+        state = dict(self.__dict__)
+        state.update(_profiler=None, stream=None)
+        return state
+
+    def fresh(self):
+        return Instrumentation()
+
+    def timer(self, name):
+        return _Timer(self.timings, name)
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def merge(self, other):
+        for name, (seconds, calls) in other.timings.items():
+            entry = self.timings.setdefault(name, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += calls
+        for name, amount in other.counters.items():
+            self.count(name, amount)
+
+    def begin(self, start, limit):
+        """
+        Records the p-range [start, limit) of the run, which the ETA is based on.
+        """
+        self.start, self.limit = start, limit
+
+    def progress(self, done, force=False):
+        """
+        Prints a progress line if progress is on and PROGRESS_INTERVAL has passed
+        since the last one. `done` is the p-value the run has reached.
+        """
+        now = time.perf_counter()
+        if not self.show_progress or (not force and now - self.last_progress < PROGRESS_INTERVAL):
+            return
+        self.last_progress = now
+        elapsed = now - self.started
+        fraction = (done - self.start) / (self.limit - self.start) if self.limit > self.start else 1
+        eta = _format_duration(elapsed * (1 - fraction) / fraction) if fraction > 0 else "?"
+        rss = current_rss()
+        print(f"[{_format_duration(elapsed)}] p = {done:,} ({fraction:.1%}), "
+              f"{self.counters.get('pairs', 0) / elapsed:,.0f} pairs/s, "
+              f"{self.counters.get('q_tests', 0) / elapsed:,.0f} q-tests/s, ETA {eta}"
+              + (f", RSS {rss / 2 ** 20:,.0f} MiB" if rss is not None else ""),
+              file=self.stream or sys.stderr, flush=True)
+
+    def __enter__(self):
+        # The profilers are imported only when asked for, keeping short runs' startup lean.
+        self.started = self.last_progress = time.perf_counter()
+        if self.trace_memory:
+            import tracemalloc
+            tracemalloc.start()
+        if self.profile_file is not None:
+            import cProfile
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._profiler is not None:
+            self._profiler.disable()
+            self._profiler.dump_stats(self.profile_file)
+            self._profiler = None
+        if self.trace_memory:
+            import tracemalloc
+            _, peak = tracemalloc.get_traced_memory()
+            top = tracemalloc.take_snapshot().statistics("lineno")[:TRACEMALLOC_TOP]
+            tracemalloc.stop()
+            self.memory = {'traced_peak_bytes': peak,
+                           'top_allocations': [{'site': str(stat.traceback), 'bytes': stat.size} for stat in top]}
+        self.elapsed = time.perf_counter() - self.started
+
+    def summary(self):
+        """
+        Returns the run summary as a JSON-ready dict: wall time, each stage's time,
+        calls and share of the wall time, the counters and their rates, and peak RSS.
+        """
+        elapsed = self.elapsed if self.elapsed is not None else time.perf_counter() - self.started
+        summary = {
+            'start': self.start, 'limit': self.limit, 'wall_seconds': elapsed,
+            'stages': {name: {'seconds': seconds, 'calls': calls, 'share': seconds / elapsed if elapsed > 0 else 0}
+                       for name, (seconds, calls) in sorted(self.timings.items(), key=lambda item: -item[1][0])},
+            'counters': dict(self.counters),
+            'rates': {f"{name}_per_second": amount / elapsed for name, amount in self.counters.items() if elapsed > 0},
+            'peak_rss_bytes': peak_rss(),
+        }
+        if self.profile_file is not None:
+            summary['profile_file'] = self.profile_file
+        if self.memory is not None:
+            summary['memory'] = self.memory
+        return summary
+
+    def write_summary(self, file_name):
+        with open(file_name, 'w') as summary_file:
+            json.dump(self.summary(), summary_file, indent=2)
+
+
+class _NoInstrumentation:
+    """
+    Stand-in used when instrumentation is off: every method does nothing.
+    """
+
+    enabled = False
+    _timer = nullcontext()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def fresh(self):
+        return self
+
+    def timer(self, name):
+        return self._timer
+
+    def count(self, name, amount=1):
+        pass
+
+    def merge(self, other):
+        pass
+
+    def begin(self, start, limit):
+        pass
+
+    def progress(self, done, force=False):
+        pass
+
+
+NO_INSTRUMENTATION = _NoInstrumentation()
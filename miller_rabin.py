@@ -0,0 +1,69 @@
+import numpy as np
+
+from prime_sieve import small_primes
+
+# Primes used to reject most composites with a vectorized divisibility test
+# before any Miller-Rabin rounds are run.
+PREFILTER_PRIMES = small_primes(1000)
+
+# Bases that make Miller-Rabin deterministic for every n < 2**64 (Jim Sinclair's set).
+WITNESSES_64 = (2, 325, 9375, 28178, 450775, 9780504, 1795265022)
+
+# The first thirteen primes as bases are deterministic for every n < 3.3 * 10**24
+# (the first twelve only below 3.18 * 10**23: psi_12 = 318665857834031151167461 passes them).
+WITNESSES_LARGE = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41)
+
+
+def _is_strong_probable_prime(n, d, r, base):
+    x = pow(base, d, n)
+    if x == 1 or x == n - 1:
+        return True
+    for _ in range(r - 1):
+        x = x * x % n
+        if x == n - 1:
+            return True
+    return False
+
+
+def is_prime_mr(n):
+    """
+    Checks if a number is prime using trial division by small primes followed
+    by deterministic Miller-Rabin. Exact for every n < 3.3 * 10**24.
+    """
+    if n < 2:
+        return False
+    for prime in PREFILTER_PRIMES:
+        if n % prime == 0:
+            return n == prime
+    if n < PREFILTER_PRIMES[-1] ** 2:
+        return True
+    return _miller_rabin(n)
+
+
+def _miller_rabin(n):
+    # n must be odd; witnesses that are multiples of n are skipped.
+    d, r = n - 1, 0
+    while d % 2 == 0:
+        d //= 2
+        r += 1
+    witnesses = WITNESSES_64 if n < 1 << 64 else WITNESSES_LARGE
+    return all(_is_strong_probable_prime(n, d, r, base % n) for base in witnesses if base % n)
+
+
+def are_prime(values):
+    """
+    Tests a whole array of non-negative values (below 2**63) for primality.
+    Small-prime divisibility is checked for the entire array at once and only the
+    survivors go through Miller-Rabin. Returns a boolean array of the same shape.
+    """
+    values = np.asarray(values, dtype=np.int64)
+    flat = values.ravel()
+    result = flat >= 2
+    for prime in PREFILTER_PRIMES:
+        result &= (flat % prime != 0) | (flat == prime)
+
+    # Survivors below the square of the largest prefilter prime are already known to be prime.
+    survivors = np.flatnonzero(result & (flat >= PREFILTER_PRIMES[-1] ** 2))
+    for index, n in zip(survivors.tolist(), flat[survivors].tolist()):
+        result[index] = _miller_rabin(n)
+    return result.reshape(values.shape)
@@ -0,0 +1,306 @@
+import os
+import pickle
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import miller_rabin
+from affine_forms import coefficients, form_label
+from instrumentation import NO_INSTRUMENTATION
+from prime_sieve import iter_twin_prime_segments, sieve_limit
+from sieve_cache import DEFAULT_CACHE_FILE, SieveCache
+
+
+def q_matrix(p_values, offsets):
+    """
+    Returns the len(p_values) x len(offsets) matrix of q = 2p + offset, built in one broadcast.
+    Offsets may also be affine forms (see affine_forms.py), giving q = a * p + b.
+    """
+    p = np.asarray(p_values, dtype=np.int64)
+    a, b = np.array([coefficients(offset) for offset in offsets], dtype=np.int64).reshape(-1, 2).T
+    return a[None, :] * p[:, None] + b[None, :]
+
+
+def offset_matrix(p_values, offsets, q_windows):
+    """
+    Evaluates every q = 2p + offset in one broadcast.
+    `q_windows` maps each multiplier to a sieve window (q_low, q_flags), as
+    yielded by iter_twin_prime_segments; plain offsets only need {2: (0, flags)}.
+    Returns a len(p_values) x len(offsets) boolean matrix; entry [i, j] is True
+    if 2 * p_values[i] + offsets[j] is prime.
+    """
+    q = q_matrix(p_values, offsets)
+    multipliers = np.array([coefficients(offset)[0] for offset in offsets], dtype=np.int64)
+    matrix = np.zeros(q.shape, dtype=bool)
+    for a, (q_low, q_flags) in q_windows.items():
+        columns = multipliers == a
+        flags = np.frombuffer(q_flags, dtype=np.uint8)
+
+        # q-values below the window (negative q for the smallest p) are never prime.
+        index = q[:, columns] - q_low
+        in_window = index >= 0
+        matrix[:, columns] = in_window & (flags[np.where(in_window, index, 0)] == 1)
+    return matrix
+
+
+def offset_matrix_tested(p_values, offsets, are_prime=miller_rabin.are_prime):
+    """
+    Same as offset_matrix, but resolves primality with a batched test on the
+    q-values themselves (Miller-Rabin by default) instead of a sieve window,
+    for magnitudes where sieving up to 2p + offset is impractical.
+    """
+    return are_prime(np.maximum(q_matrix(p_values, offsets), 0))
+
+
+def offset_primes(p_values, offsets, matrix):
+    """
+    Returns the prime q-values picked out by an offset matrix, ordered by p
+    and then by the position of the offset in `offsets`.
+    """
+    return q_matrix(p_values, offsets)[matrix]
+
+
+def success_counts(matrix):
+    """
+    Returns an array where entry i is the number of p-values for which exactly
+    i offsets produced a prime.
+    """
+    return np.bincount(matrix.sum(axis=1), minlength=matrix.shape[1] + 1)
+
+
+def offset_totals(matrix):
+    """
+    Returns the number of primes produced by each offset (one entry per column).
+    """
+    return matrix.sum(axis=0)
+
+
+def mask_dtype(offset_count):
+    """
+    Returns the narrowest unsigned integer type with one bit per offset.
+    """
+    width = max(1, (offset_count + 7) // 8)
+    return np.dtype(f"<u{1 << (width - 1).bit_length()}")
+
+
+def success_masks(matrix):
+    """
+    Packs each row of an offset matrix into an integer bitmask: bit j is set
+    if offset j produced a prime. Uses the narrowest unsigned type that fits.
+    """
+    dtype = mask_dtype(matrix.shape[1])
+    weights = (np.ones(1, dtype=dtype) << np.arange(matrix.shape[1], dtype=dtype))
+    return (matrix.astype(dtype) * weights).sum(axis=1, dtype=dtype)
+
+
+# Number of set bits in every possible byte value.
+_POPCOUNT = np.array([bin(byte).count("1") for byte in range(256)], dtype=np.uint8)
+
+
+def popcount(masks):
+    """
+    Returns the number of set bits in each entry of an unsigned integer array,
+    i.e. the success count of each success mask.
+    """
+    masks = np.ascontiguousarray(masks)
+    as_bytes = masks.view(np.uint8).reshape(masks.shape + (masks.dtype.itemsize,))
+    return _POPCOUNT[as_bytes].sum(axis=-1, dtype=np.int64)
+
+
+def cumulative_counts(exact_counts):
+    """
+    Turns an exact success distribution into a cumulative one: entry i is the
+    number of p-values for which at least i offsets produced a prime.
+    """
+    return np.cumsum(np.asarray(exact_counts)[::-1])[::-1]
+
+
+# One segment's worth of evaluated twin primes, handed to every report in the pipeline.
+# `matrix[i, j]` is True if 2 * p[i] + offsets[j] is prime; `primes` lists those q-values
+# in p/offset order and `residues` holds p % 30 (so residues % 10 is the last digit of p).
+OffsetBatch = namedtuple("OffsetBatch", ["p", "offsets", "matrix", "primes", "residues"])
+
+
+def offset_label(offset):
+    """
+    Returns the display label of an offset, e.g. "2p+1" or "2p-3" (or "3(p+2)+1" for a form).
+    """
+    return form_label(offset)
+
+
+def shard_bounds(limit, shards, start=0):
+    """
+    Splits the p-range [start, limit) into at most `shards` contiguous [start, stop) ranges.
+    """
+    step = max(-(-(limit - start) // shards), 1)
+    return [(low, min(low + step, limit)) for low in range(start, limit, step)]
+
+
+# How q-values are tested: a sieve window per segment, batched Miller-Rabin
+# for magnitudes where sieving up to 2p + offset is impractical, or lookups in
+# the persistent sieve cache file (see sieve_cache.py), which then also supplies
+# the twin primes.
+PRIMALITY_BACKENDS = ("sieve", "miller-rabin", "cache")
+
+
+def analyze_shard(start, stop, offsets, reports, on_segment=None, primality="sieve", sieve_cache=DEFAULT_CACHE_FILE,
+                  instrumentation=NO_INSTRUMENTATION, cache_ready=False):
+    """
+    Sieves the p-range [start, stop) once (only that window, so it works just as
+    well high up as from 0), evaluates each (p, offset) once and
+    feeds every segment to all of the reports. Returns the reports.
+    If given, on_segment(done) is called after each segment with the p-value
+    up to which the reports are complete. Each stage is timed and the pairs
+    and q-tests counted on `instrumentation` (see instrumentation.py).
+    With primality="cache", `sieve_cache` names the cache file, which is
+    verified and extended first if it does not cover the shard; with cache_ready
+    the caller has already done both, and the file is just mapped.
+    """
+    if primality not in PRIMALITY_BACKENDS:
+        raise ValueError(f"unknown primality backend '{primality}'")
+    sieve_q = primality == "sieve"
+    if primality == "cache":
+        cache = SieveCache(sieve_cache, verify=not cache_ready)
+        if not cache_ready:
+            with instrumentation.timer("sieve_segments"):
+                cache.ensure(sieve_limit(stop, offsets) + 1)
+        segments = cache.iter_twin_prime_segments(stop, start)
+        are_prime = cache.are_prime
+    else:
+        segments = iter_twin_prime_segments(stop, offsets, start=start, sieve_q=sieve_q, instrumentation=instrumentation)
+        are_prime = miller_rabin.are_prime
+    update_timers = [f"update:{type(report).__name__}" for report in reports]
+    for segment in segments:
+        p = np.asarray(segment.twin_ps, dtype=np.int64)
+        with instrumentation.timer("offset_tests"):
+            if sieve_q:
+                matrix = offset_matrix(p, offsets, segment.q_windows)
+            else:
+                matrix = offset_matrix_tested(p, offsets, are_prime)
+            residues = np.asarray(segment.residues, dtype=np.uint8)
+            batch = OffsetBatch(p, offsets, matrix, offset_primes(p, offsets, matrix), residues)
+        for report, update_timer in zip(reports, update_timers):
+            with instrumentation.timer(update_timer):
+                report.update(batch)
+        instrumentation.count("segments")
+        instrumentation.count("pairs", len(p))
+        instrumentation.count("q_tests", len(p) * len(offsets))
+        if on_segment is not None:
+            on_segment(segment.high)
+    if primality == "cache":
+        cache.close()
+    return reports
+
+
+def _analyze_shard_star(args):
+    # The shard's instrumentation comes back with its reports, to be merged like them.
+    *shard_args, cache_ready, instrumentation = args
+    return analyze_shard(*shard_args, instrumentation=instrumentation, cache_ready=cache_ready), instrumentation
+
+
+def report_key(report):
+    """
+    Identifies a report by its type plus any parameters its state depends on
+    (its `store_parameters`, e.g. the moduli), as in "ResidueClassReport(moduli=(10, 30))".
+    """
+    parameters = ", ".join(f"{name}={getattr(report, name)!r}" for name in getattr(report, 'store_parameters', ()))
+    return f"{type(report).__name__}({parameters})" if parameters else type(report).__name__
+
+
+# Seconds between checkpoints of a long run.
+CHECKPOINT_INTERVAL = 300
+
+
+def save_checkpoint(file_name, start, limit, offsets, done, reports):
+    """
+    Atomically writes the run state: the run's p-range and offsets, the p-value
+    up to which the reports are complete and the reports themselves, along with
+    their report_key. A crash mid-write leaves the previous checkpoint intact.
+    """
+    state = {'start': start, 'limit': limit, 'offsets': list(offsets), 'done': done,
+             'report_keys': [report_key(report) for report in reports], 'reports': reports}
+    with open(file_name + ".tmp", 'wb') as state_file:
+        pickle.dump(state, state_file, protocol=pickle.HIGHEST_PROTOCOL)
+        state_file.flush()
+        os.fsync(state_file.fileno())
+    os.replace(file_name + ".tmp", file_name)
+
+
+def load_checkpoint(file_name, start, limit, offsets, reports):
+    """
+    Restores the saved report state into `reports` and returns the p-value to resume from.
+    Raises ValueError if the checkpoint belongs to a different run: another p-range,
+    other offsets, or reports of another type or configuration.
+    """
+    with open(file_name, 'rb') as state_file:
+        state = pickle.load(state_file)
+    if (state.get('start') != start or state['limit'] != limit or state['offsets'] != list(offsets)
+            or state.get('report_keys') != [report_key(report) for report in reports]):
+        raise ValueError(f"checkpoint '{file_name}' was written for a different run")
+    for report, saved_report in zip(reports, state['reports']):
+        report.__dict__.update(saved_report.__dict__)
+    return state['done']
+
+
+def run_offset_pipeline(limit, offsets, reports, workers=1, checkpoint=None, resume=False,
+                        checkpoint_interval=CHECKPOINT_INTERVAL, start=0, primality="sieve",
+                        sieve_cache=DEFAULT_CACHE_FILE, instrumentation=NO_INSTRUMENTATION):
+    """
+    Runs the offset analysis for all twin primes with start <= p < limit in a
+    single pass, feeding the results to each report (see offset_reports.py).
+
+    With workers > 1 the p-range is split into shards that run in separate
+    processes, each on fresh (empty) copies of the reports. The copies are merged back
+    in shard order, so the result is identical for any number of workers.
+
+    If `checkpoint` names a state file, the reports and the position reached are
+    saved to it every `checkpoint_interval` seconds, and with `resume` a run
+    continues from the last completed segment (or shard). The result is
+    identical to an uninterrupted run. The state file is removed on completion.
+
+    `primality` picks how q-values are tested (see PRIMALITY_BACKENDS);
+    "cache" reads them and the twin primes from the `sieve_cache` file.
+    Stage timings, counters and progress go to `instrumentation`; shards
+    send theirs back with their reports.
+    Returns the reports.
+    """
+    # The checkpoint keeps recording the run's own start; the analysis picks up where it left off.
+    resume_from = start
+    if resume and checkpoint is not None and os.path.exists(checkpoint):
+        resume_from = load_checkpoint(checkpoint, start, limit, offsets, reports)
+
+    last_saved = time.monotonic()
+    instrumentation.begin(resume_from, limit)
+
+    def on_progress(done):
+        nonlocal last_saved
+        instrumentation.progress(done)
+        if checkpoint is not None and time.monotonic() - last_saved >= checkpoint_interval:
+            with instrumentation.timer("checkpoint"):
+                save_checkpoint(checkpoint, start, limit, offsets, done, reports)
+            last_saved = time.monotonic()
+
+    if workers <= 1:
+        analyze_shard(resume_from, limit, offsets, reports, on_progress, primality, sieve_cache, instrumentation)
+    else:
+        if primality == "cache":
+            # Verify and extend the cache once here, so the workers all just map it.
+            with SieveCache(sieve_cache) as cache, instrumentation.timer("sieve_segments"):
+                cache.ensure(sieve_limit(limit, offsets) + 1)
+        shards = shard_bounds(limit, workers * 4, resume_from)
+        tasks = [(low, stop, offsets, [report.fresh() for report in reports], None, primality, sieve_cache,
+                  primality == "cache", instrumentation.fresh()) for low, stop in shards]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for (low, stop), (shard_reports, shard_instrumentation) in zip(shards, pool.map(_analyze_shard_star, tasks)):
+                with instrumentation.timer("merge"):
+                    for report, shard_report in zip(reports, shard_reports):
+                        report.merge(shard_report)
+                instrumentation.merge(shard_instrumentation)
+                on_progress(stop)
+
+    instrumentation.progress(limit, force=True)
+    if checkpoint is not None and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    return reports
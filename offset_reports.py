@@ -0,0 +1,579 @@
+import copy
+import csv
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from affine_forms import coefficients
+from hardy_littlewood import write_expected_counts
+from offset_analysis import (cumulative_counts, mask_dtype, offset_label, offset_totals, popcount, success_counts,
+                             success_masks)
+from offset_search import MaskHistogram, collapse_q_masks, family_count, q_bounds, rank_families
+from offset_table import rechunk, write_offset_table
+from twin_index import write_twin_index
+
+# Every report is an aggregator for offset_analysis.run_offset_pipeline:
+# - update(batch) folds in one OffsetBatch,
+# - merge(other) folds in a report of the same kind built over a later p-range,
+# - fresh() returns an empty report with the same configuration (for shard copies),
+# - write() saves the report to its CSV file.
+# A report whose accumulated state depends on constructor parameters other than
+# the offsets lists them in `store_parameters`, so the results store and
+# checkpoints only hand saved state to a report configured the same way.
+# Adding a report means adding a class here; the pipeline still makes a single pass.
+
+
+# Bytes of bitmap processed at a time when counting or iterating.
+_BLOCK_BYTES = 1 << 20
+
+# Untouched bytes (8 bits each, i.e. 16 numbers) a unique-prime bitmap bridges
+# before it starts a separate span.
+_SPAN_GAP_BYTES = 1 << 20
+
+
+class UniquePrimeBitmap:
+    """
+    Tracks the distinct primes produced with one bit per odd candidate:
+    q is recorded as bit (q - 1) // 2, and the even prime 2 (which forms with an
+    odd multiplier can produce) shares bit 0 with 1, never prime. Only the spans of bytes actually touched
+    are stored, in separate bitmaps wherever the q-values leave a gap of more than _SPAN_GAP_BYTES:
+    forms with different multipliers (2p + 1 and 3p - 2 high up) get one bitmap per q-window rather than
+    one across the gap between them, and a shard's bitmaps cover its own q-windows and no more.
+    Deduplication, counting and sorted iteration are all linear.
+    """
+
+    def __init__(self):
+        self.spans = []  # [first byte, bits], sorted and disjoint
+
+    def __setstate__(self, state):
+        # Bitmaps pickled before the spans were introduced hold a single span.
+        if 'bits' in state:
+            state = {'spans': [[state['first_byte'], state['bits']]] if len(state['bits']) else []}
+        self.__dict__.update(state)
+
+    def _cover(self, first_byte, stop_byte):
+        """
+        Returns the span covering bytes [first_byte, stop_byte), creating, growing
+        or joining spans as needed. Growth to the right doubles the capacity, since
+        segments arrive in increasing q order.
+        """
+        near = [i for i, (first, bits) in enumerate(self.spans)
+                if first - _SPAN_GAP_BYTES < stop_byte and first_byte < first + len(bits) + _SPAN_GAP_BYTES]
+        if not near:
+            span = [first_byte, np.zeros(stop_byte - first_byte, dtype=np.uint8)]
+            self.spans.insert(sum(first < first_byte for first, _ in self.spans), span)
+            return span
+        first, bits = self.spans[near[0]]
+        if len(near) == 1 and first <= first_byte and stop_byte <= first + len(bits):
+            return self.spans[near[0]]
+
+        last_first, last_bits = self.spans[near[-1]]
+        current_stop = last_first + len(last_bits)
+        new_first = min(first, first_byte)
+        new_stop = max(stop_byte, current_stop + len(last_bits)) if stop_byte > current_stop else current_stop
+        if near[-1] + 1 < len(self.spans):
+            new_stop = min(new_stop, self.spans[near[-1] + 1][0])
+        grown = np.zeros(new_stop - new_first, dtype=np.uint8)
+        for first, bits in self.spans[near[0]:near[-1] + 1]:
+            grown[first - new_first:first - new_first + len(bits)] = bits
+        span = [new_first, grown]
+        self.spans[near[0]:near[-1] + 1] = [span]
+        return span
+
+    def add(self, primes):
+        if not len(primes):
+            return
+        index = np.sort((np.asarray(primes, dtype=np.int64) - 1) // 2)
+        for part in np.split(index, np.flatnonzero(np.diff(index >> 3) > _SPAN_GAP_BYTES) + 1):
+            first, bits = self._cover(int(part[0] >> 3), int(part[-1] >> 3) + 1)
+            np.bitwise_or.at(bits, (part >> 3) - first, (1 << (part & 7)).astype(np.uint8))
+
+    def merge(self, other):
+        for other_first, other_bits in other.spans:
+            first, bits = self._cover(other_first, other_first + len(other_bits))
+            bits[other_first - first:other_first - first + len(other_bits)] |= other_bits
+
+    def __iter__(self):
+        """
+        Yields arrays of the unique primes in ascending order.
+        """
+        for first, bits in self.spans:
+            for start in range(0, len(bits), _BLOCK_BYTES):
+                block = np.unpackbits(bits[start:start + _BLOCK_BYTES], bitorder='little')
+                primes = (np.flatnonzero(block) + 8 * (first + start)) * 2 + 1
+                yield np.where(primes == 1, 2, primes)
+
+    def count(self):
+        return sum(int(popcount(bits[start:start + _BLOCK_BYTES]).sum())
+                   for _, bits in self.spans for start in range(0, len(bits), _BLOCK_BYTES))
+
+
+# Rows formatted and written per batch by the streaming CSV writer.
+_BATCH_ROWS = 1 << 16
+
+
+def write_columns_csv(file_name, headers, columns, batch_rows=_BATCH_ROWS):
+    """
+    Writes columns side by side, padding the shorter ones with blanks, in the
+    same format as csv.writer. Each column is a stream of integer arrays that
+    is consumed batch by batch, so no column is ever held in memory in full.
+    """
+    batches = [rechunk(column, batch_rows) for column in columns]
+    with open(file_name, 'w', newline='', buffering=1 << 20) as csvfile:
+        csv.writer(csvfile).writerow(headers)
+        while True:
+            parts = [next(column_batches, None) for column_batches in batches]
+            rows = max((len(part) for part in parts if part is not None), default=0)
+            if rows == 0:
+                break
+            texts = []
+            for part in parts:
+                text = [] if part is None else list(map(str, part.tolist()))
+                texts.append(text + [""] * (rows - len(text)))
+            csvfile.write("\r\n".join(map(",".join, zip(*texts))) + "\r\n")
+
+
+class AllPrimesReport:
+    """
+    All primes produced (including repeats) and the unique primes, side by side,
+    or in two single-column files when split_columns is set.
+
+    The primes produced are spilled to a temporary binary file (in `spill_dir`,
+    or the system temp directory) as they arrive and the unique primes live in
+    a bitmap, so neither list is ever materialized.
+    """
+
+    file_name = "twin_prime_analysis.csv"
+
+    def __init__(self, offsets, split_columns=False, spill_dir=None):
+        self.offsets = offsets
+        self.split_columns = split_columns
+        self.spill_dir = spill_dir
+        self.twin_count = 0
+        self.prime_count = 0
+        self.spill_name = None
+        self.unique_primes = UniquePrimeBitmap()
+
+    def __getstate__(self):
+        # A pickled report (e.g. in a checkpoint) records how much of the spill file it owns.
+        state = dict(self.__dict__)
+        state['spill_size'] = os.path.getsize(self.spill_name) if self.spill_name is not None else 0
+        return state
+
+    def __setstate__(self, state):
+        # Drop anything appended to the spill file after the state was saved.
+        spill_size = state.pop('spill_size', 0)
+        self.__dict__.update(state)
+        if self.spill_name is not None:
+            with open(self.spill_name, 'ab') as spill:
+                spill.truncate(spill_size)
+
+    def clone(self, spill_dir=None):
+        """
+        Returns an independent copy of the report with its own copy of the spill file.
+        """
+        twin = copy.deepcopy(self)
+        twin.spill_dir = spill_dir
+        twin.spill_name = None
+        if self.spill_name is not None:
+            with twin._spill() as spill, open(self.spill_name, 'rb') as own_spill:
+                shutil.copyfileobj(own_spill, spill, 1 << 20)
+        return twin
+
+    def _spill(self):
+        if self.spill_name is None:
+            spill_fd, self.spill_name = tempfile.mkstemp(prefix="twin_prime_all_", suffix=".bin", dir=self.spill_dir)
+            os.close(spill_fd)
+        return open(self.spill_name, 'ab')
+
+    def _iter_all_primes(self):
+        if self.spill_name is None:
+            return
+        with open(self.spill_name, 'rb') as spill:
+            while True:
+                chunk = np.fromfile(spill, dtype=np.int64, count=_BATCH_ROWS)
+                if not len(chunk):
+                    break
+                yield chunk
+
+    def fresh(self):
+        return AllPrimesReport(self.offsets, self.split_columns, self.spill_dir)
+
+    def update(self, batch):
+        self.twin_count += len(batch.p)
+        self.prime_count += len(batch.primes)
+        with self._spill() as spill:
+            batch.primes.astype(np.int64).tofile(spill)
+        self.unique_primes.add(batch.primes)
+
+    def merge(self, other):
+        self.twin_count += other.twin_count
+        self.prime_count += other.prime_count
+        if other.spill_name is not None:
+            with self._spill() as spill, open(other.spill_name, 'rb') as other_spill:
+                shutil.copyfileobj(other_spill, spill, 1 << 20)
+            os.remove(other.spill_name)
+            other.spill_name = None
+        self.unique_primes.merge(other.unique_primes)
+
+    def write(self, file_name=None):
+        """
+        Streams the report to disk, then removes the spill file.
+        """
+        file_name = file_name or self.file_name
+        if self.split_columns:
+            stem, extension = os.path.splitext(file_name)
+            write_columns_csv(f"{stem}_all{extension}", ["All Primes Produced (including repeats)"], [self._iter_all_primes()])
+            write_columns_csv(f"{stem}_unique{extension}", ["Unique Primes Produced"], [iter(self.unique_primes)])
+        else:
+            write_columns_csv(file_name, ["All Primes Produced (including repeats)", "Unique Primes Produced"],
+                              [self._iter_all_primes(), iter(self.unique_primes)])
+        if self.spill_name is not None:
+            os.remove(self.spill_name)
+            self.spill_name = None
+
+
+class SuccessDistributionReport:
+    """
+    Exact and cumulative distribution of how many offsets succeeded per twin prime.
+    """
+
+    file_name = "offset_distribution.csv"
+
+    def __init__(self, offsets):
+        self.offsets = offsets
+        self.twin_count = 0
+        self.exact_counts = np.zeros(len(offsets) + 1, dtype=np.int64)
+        self.unique_primes = UniquePrimeBitmap()
+
+    def fresh(self):
+        return SuccessDistributionReport(self.offsets)
+
+    def update(self, batch):
+        self.twin_count += len(batch.p)
+        self.exact_counts += success_counts(batch.matrix)
+        self.unique_primes.add(batch.primes)
+
+    def merge(self, other):
+        self.twin_count += other.twin_count
+        self.exact_counts += other.exact_counts
+        self.unique_primes.merge(other.unique_primes)
+
+    def write(self, file_name=None):
+        total_twin_primes = self.twin_count
+        exact_counts = self.exact_counts
+        at_least_counts = cumulative_counts(exact_counts)
+
+        with open(file_name or self.file_name, 'w', newline='') as csvfile:
+            writer = csv.writer(csvfile)
+
+            # Write a summary section at the top.
+            writer.writerow(["Summary", "Value", "Percentage"])
+            writer.writerow(["Total twin prime pairs considered", total_twin_primes, ""])
+            writer.writerow(["Unique prime numbers produced", self.unique_primes.count(), ""])
+            writer.writerow([]) # Blank row for separation
+
+            # Write the exact success count distribution.
+            writer.writerow(["Exact success count distribution", "", ""])
+            writer.writerow(["Offsets Succeeded", "Count", "Percentage"])
+            for i in range(len(self.offsets) + 1):
+                count = exact_counts[i]
+                percentage = (count / total_twin_primes) * 100 if total_twin_primes > 0 else 0
+                writer.writerow([i, count, f"{percentage:.2f}%"])
+
+            writer.writerow([]) # Blank row for separation
+
+            # Write the cumulative success count distribution.
+            writer.writerow(["Cumulative success count distribution", "", ""])
+            writer.writerow(["Offsets Succeeded", "Count", "Percentage"])
+            for i in range(len(self.offsets), 0, -1):
+                count = at_least_counts[i]
+                percentage = (count / total_twin_primes) * 100 if total_twin_primes > 0 else 0
+                writer.writerow([f"at least {i}", count, f"{percentage:.2f}%"])
+
+
+class LastDigitReport:
+    """
+    Per-offset successes grouped by the last digit of p.
+    Only (3,5) and (5,7) fall outside the three categories.
+    """
+
+    file_name = "offset_success_by_digit.csv"
+    labels = {1: "(1,3) ending pairs", 7: "(7,9) ending pairs", 9: "(9,1) ending pairs"}
+
+    def __init__(self, offsets):
+        self.offsets = offsets
+        self.twin_count = 0
+        self.pairs = {digit: 0 for digit in self.labels}
+        self.successes = {digit: np.zeros(len(offsets), dtype=np.int64) for digit in self.labels}
+
+    def fresh(self):
+        return LastDigitReport(self.offsets)
+
+    def update(self, batch):
+        self.twin_count += len(batch.p)
+        p_last_digits = batch.residues % 10
+        for digit in self.labels:
+            in_category = p_last_digits == digit
+            self.pairs[digit] += int(in_category.sum())
+            self.successes[digit] += offset_totals(batch.matrix[in_category])
+
+    def merge(self, other):
+        self.twin_count += other.twin_count
+        for digit in self.labels:
+            self.pairs[digit] += other.pairs[digit]
+            self.successes[digit] += other.successes[digit]
+
+    def write(self, file_name=None):
+        with open(file_name or self.file_name, 'w', newline='') as csvfile:
+            writer = csv.writer(csvfile)
+
+            writer.writerow(["Offset Success by Last Digit Categories"])
+            writer.writerow(["", "", ""]) # Blank row for separation
+
+            # Write results for each category.
+            for digit in sorted(self.labels):
+                offset_successes = dict(zip(self.offsets, self.successes[digit].tolist()))
+                total_primes_produced = sum(offset_successes.values())
+
+                writer.writerow([f"Results: Offset Success for {self.labels[digit]}: (Total pairs: {self.pairs[digit]})", "", ""])
+
+                # Sort offsets for consistent output order.
+                for offset in sorted(self.offsets, key=coefficients):
+                    success_count = offset_successes[offset]
+                    # The percentage is calculated based on the total primes produced in the category.
+                    percentage = (success_count / total_primes_produced) * 100 if total_primes_produced > 0 else 0
+                    writer.writerow([f"Offset {offset_label(offset)}:", f"{success_count} successes", f"({percentage:.2f}%)"])
+
+                writer.writerow(["Primes produced:", total_primes_produced, ""])
+                writer.writerow(["", "", ""]) # Blank row for separation
+
+
+class ResidueClassReport:
+    """
+    Per-offset successes grouped by p mod m, for each of several moduli at once
+    (the last digit is the case m = 10). Each modulus costs one bincount per
+    batch over a combined (residue, offset) index.
+    """
+
+    file_name = "offset_success_by_residue.csv"
+    store_parameters = ("moduli",)
+
+    def __init__(self, offsets, moduli=(10, 30, 210, 2310)):
+        self.offsets = offsets
+        self.moduli = list(moduli)
+        self.twin_count = 0
+        self.pairs = {modulus: np.zeros(modulus, dtype=np.int64) for modulus in self.moduli}
+        self.successes = {modulus: np.zeros((modulus, len(offsets)), dtype=np.int64) for modulus in self.moduli}
+
+    def fresh(self):
+        return ResidueClassReport(self.offsets, self.moduli)
+
+    def update(self, batch):
+        self.twin_count += len(batch.p)
+        rows, columns = np.nonzero(batch.matrix)
+        for modulus in self.moduli:
+            residues = batch.p % modulus
+            self.pairs[modulus] += np.bincount(residues, minlength=modulus)
+            index = residues[rows] * len(self.offsets) + columns
+            self.successes[modulus] += np.bincount(index, minlength=modulus * len(self.offsets)).reshape(modulus, -1)
+
+    def merge(self, other):
+        self.twin_count += other.twin_count
+        for modulus in self.moduli:
+            self.pairs[modulus] += other.pairs[modulus]
+            self.successes[modulus] += other.successes[modulus]
+
+    def write(self, file_name=None):
+        with open(file_name or self.file_name, 'w', newline='') as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(["Modulus", "Residue", "Pairs"] + [offset_label(offset) for offset in self.offsets]
+                            + ["Primes produced", "Share of pairs"])
+
+            # Only the residue classes that hold twin primes are listed.
+            for modulus in self.moduli:
+                for residue in np.flatnonzero(self.pairs[modulus]).tolist():
+                    pairs = int(self.pairs[modulus][residue])
+                    successes = self.successes[modulus][residue].tolist()
+                    share = (pairs / self.twin_count) * 100 if self.twin_count > 0 else 0
+                    writer.writerow([modulus, residue, pairs] + successes + [sum(successes), f"{share:.2f}%"])
+
+
+class HardyLittlewoodReport(ResidueClassReport):
+    """
+    Observed twin prime and per-offset counts, overall and per residue class,
+    next to the counts the Hardy-Littlewood conjecture predicts for the run's
+    p-range [start, limit) (see hardy_littlewood.py).
+    """
+
+    file_name = "offset_expected_counts.csv"
+
+    def __init__(self, offsets, limit, start=0, moduli=(10,)):
+        super().__init__(offsets, moduli)
+        self.limit = limit
+        self.start = start
+        self.totals = np.zeros(len(offsets), dtype=np.int64)
+
+    def fresh(self):
+        return HardyLittlewoodReport(self.offsets, self.limit, self.start, self.moduli)
+
+    def update(self, batch):
+        super().update(batch)
+        self.totals += offset_totals(batch.matrix)
+
+    def merge(self, other):
+        super().merge(other)
+        self.totals += other.totals
+
+    def write(self, file_name=None):
+        write_expected_counts(file_name or self.file_name, self.offsets, self.limit, self.start, self.moduli, self)
+
+
+class MainTableReport:
+    """
+    The per-pair main table in the compact columnar format of offset_table.py:
+    p, a bitmask of the offsets that succeeded and the last digit of p.
+    """
+
+    file_name = "7offsets_main_table.bin"
+
+    def __init__(self, offsets):
+        self.offsets = offsets
+        self.twin_count = 0
+        self.p_chunks = []
+        self.mask_chunks = []
+        self.category_chunks = []
+
+    def fresh(self):
+        return MainTableReport(self.offsets)
+
+    def update(self, batch):
+        self.twin_count += len(batch.p)
+        self.p_chunks.append(batch.p)
+        self.mask_chunks.append(success_masks(batch.matrix))
+        self.category_chunks.append(batch.residues % 10)
+
+    def merge(self, other):
+        self.twin_count += other.twin_count
+        self.p_chunks.extend(other.p_chunks)
+        self.mask_chunks.extend(other.mask_chunks)
+        self.category_chunks.extend(other.category_chunks)
+
+    def write(self, file_name=None):
+        write_offset_table(file_name or self.file_name, self.offsets, self.p_chunks, self.mask_chunks,
+                           self.category_chunks)
+
+
+class TwinIndexReport(MainTableReport):
+    """
+    The twin primes and their success masks as an indexed store with rank,
+    select and range queries (see twin_index.py).
+    """
+
+    file_name = "7offsets_twin_index.bin"
+
+    def fresh(self):
+        return TwinIndexReport(self.offsets)
+
+    def write(self, file_name=None):
+        write_twin_index(file_name or self.file_name, self.offsets, self.p_chunks, self.mask_chunks)
+
+
+class FamilySearchReport:
+    """
+    Ranks every family of `size` offsets drawn from the pool of offsets the
+    pipeline evaluates, by primes produced, unique primes and the number of
+    twin primes with at least one success (see offset_search.py).
+
+    A q-value can be produced from two different twin primes, so its mask is
+    only final once no other p can produce it. Entries that p-values before
+    the report's range (head) or after it (tail) could still reach are kept
+    aside until a merge or write settles them.
+    """
+
+    file_name = "offset_family_search.csv"
+
+    def __init__(self, offsets, size=7, top=20, rank_by="unique"):
+        self.offsets = offsets
+        self.size = size
+        self.top = top
+        self.rank_by = rank_by
+        self.twin_count = 0
+        self.totals = np.zeros(len(offsets), dtype=np.int64)
+        dtype = mask_dtype(len(offsets))
+        self.p_masks = MaskHistogram(dtype)
+        self.q_masks = MaskHistogram(dtype)
+        self.first_p = self.last_p = None
+        self.head = self.tail = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=dtype))
+
+    def fresh(self):
+        return FamilySearchReport(self.offsets, self.size, self.top, self.rank_by)
+
+    def _settle(self, entries):
+        """
+        Files collapsed (q, mask) entries: those later p-values could still reach
+        stay in the tail, those earlier p-values could reach join the head, and
+        the rest go into the q-mask histogram.
+        """
+        q, masks = collapse_q_masks(*entries)
+        open_right = q >= q_bounds(self.offsets, self.last_p + 1)[0]
+        open_left = ~open_right & (q <= q_bounds(self.offsets, self.first_p - 1)[1])
+        self.tail = (q[open_right], masks[open_right])
+        self.head = collapse_q_masks(np.concatenate([self.head[0], q[open_left]]),
+                                     np.concatenate([self.head[1], masks[open_left]]))
+        self.q_masks.add(masks[~open_right & ~open_left])
+
+    def update(self, batch):
+        if not len(batch.p):
+            return
+        self.twin_count += len(batch.p)
+        self.totals += offset_totals(batch.matrix)
+        masks = success_masks(batch.matrix)
+        self.p_masks.add(masks)
+
+        if self.first_p is None:
+            self.first_p = int(batch.p[0])
+        self.last_p = int(batch.p[-1])
+        rows, columns = np.nonzero(batch.matrix)
+        bits = (np.ones(1, dtype=masks.dtype) << columns.astype(masks.dtype))
+        self._settle((np.concatenate([self.tail[0], batch.primes.astype(np.int64)]), np.concatenate([self.tail[1], bits])))
+
+    def merge(self, other):
+        if other.first_p is None:
+            return
+        if self.first_p is None:
+            self.__dict__.update(other.__dict__)
+            return
+        self.twin_count += other.twin_count
+        self.totals += other.totals
+        self.p_masks.merge(other.p_masks)
+        self.q_masks.merge(other.q_masks)
+        # Entries near the boundary between the two ranges meet here; the
+        # other report's head and tail are settled against the combined range.
+        self.last_p = other.last_p
+        self._settle((np.concatenate([self.tail[0], other.head[0], other.tail[0]]),
+                      np.concatenate([self.tail[1], other.head[1], other.tail[1]])))
+
+    def q_histogram(self):
+        """
+        Returns the final q-mask histogram: at the end of the run nothing else can reach the head and tail.
+        """
+        histogram = copy.deepcopy(self.q_masks)
+        histogram.add(self.head[1])
+        histogram.add(self.tail[1])
+        return histogram.compact()
+
+    def write(self, file_name=None):
+        families, scores = rank_families(self.totals, self.p_masks.compact(), self.q_histogram(),
+                                         self.size, self.top, self.rank_by)
+        with open(file_name or self.file_name, 'w', newline='') as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow([f"Best {len(families)} of {family_count(len(self.offsets), self.size)} families of "
+                             f"{self.size} offsets (pool of {len(self.offsets)}, ranked by {self.rank_by})", "", "", "", "", ""])
+            writer.writerow(["Rank", "Offsets", "Primes produced", "Unique primes", "Pairs with at least one success", "Coverage"])
+            for rank, (family, (produced, unique, covered)) in enumerate(zip(families.tolist(), scores.tolist()), start=1):
+                coverage = (covered / self.twin_count) * 100 if self.twin_count > 0 else 0
+                labels = " ".join(offset_label(self.offsets[index]) for index in family)
+                writer.writerow([rank, labels, produced, unique, covered, f"{coverage:.2f}%"])
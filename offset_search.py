@@ -0,0 +1,168 @@
+import itertools
+import math
+
+import numpy as np
+
+from affine_forms import coefficients
+
+# Search over families of offsets drawn from a larger pool.
+#
+# The pipeline evaluates the whole pool once; FamilySearchReport condenses the result into
+# two histograms of success masks (one bit per pool offset):
+#   - per twin prime p: which pool offsets made 2p + b prime,
+#   - per prime q produced: which pool offsets produced q (usually one, more when
+#     2p + b = 2p' + b' for two twin primes).
+# Every subset S of the pool is then scored without touching primality again:
+#   yield     = sum of the per-offset totals over S,
+#   coverage  = number of p whose mask shares a bit with S,
+#   unique    = number of q whose mask shares a bit with S.
+
+
+class MaskHistogram:
+    """
+    Counts of distinct success masks. Masks are buffered as they arrive and
+    compacted into (masks, counts) once the buffer outgrows the compacted part.
+    """
+
+    def __init__(self, dtype):
+        self.masks = np.zeros(0, dtype=dtype)
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.pending = []
+        self.pending_size = 0
+
+    def add(self, masks, counts=None):
+        if not len(masks):
+            return
+        if counts is None:
+            counts = np.ones(len(masks), dtype=np.int64)
+        self.pending.append((np.asarray(masks, dtype=self.masks.dtype), np.asarray(counts, dtype=np.int64)))
+        self.pending_size += len(masks)
+        if self.pending_size > max(len(self.masks), 1 << 16):
+            self.compact()
+
+    def merge(self, other):
+        other.compact()
+        self.add(other.masks, other.counts)
+
+    def compact(self):
+        """
+        Folds the buffered masks into the compacted histogram and returns (masks, counts).
+        """
+        if self.pending:
+            masks = np.concatenate([self.masks] + [masks for masks, _ in self.pending])
+            counts = np.concatenate([self.counts] + [counts for _, counts in self.pending])
+            self.masks, inverse = np.unique(masks, return_inverse=True)
+            self.counts = np.bincount(inverse.ravel(), weights=counts, minlength=len(self.masks)).astype(np.int64)
+            self.pending, self.pending_size = [], 0
+        return self.masks, self.counts
+
+
+def collapse_q_masks(q, masks):
+    """
+    Merges entries for the same q-value by OR-ing their masks.
+    Returns the distinct q-values in ascending order and their combined masks.
+    """
+    if not len(q):
+        return q, masks
+    order = np.argsort(q, kind='stable')
+    q, masks = q[order], masks[order]
+    starts = np.flatnonzero(np.r_[True, q[1:] != q[:-1]])
+    return q[starts], np.bitwise_or.reduceat(masks, starts)
+
+
+def q_bounds(offsets, p):
+    """
+    Returns the smallest and largest q-value any of the offsets produces for p.
+    """
+    values = [a * p + b for a, b in map(coefficients, offsets)]
+    return min(values), max(values)
+
+
+def _mask_bits(masks, width, dtype=np.float32):
+    # Expands each mask into a row of 0/1 entries, one column per pool offset.
+    return ((masks[:, None] >> np.arange(width, dtype=masks.dtype)[None, :]) & 1).astype(dtype)
+
+
+def _split_histogram(masks, counts, width):
+    """
+    Splits a histogram into the masks with a single bit, which contribute
+    linearly to any subset's score (one weight per offset), and the masks with
+    several bits, which need the OR test. Masks without any bit never count.
+    The scores are computed with single precision matrix products while the
+    totals stay exactly representable in it.
+    """
+    dtype = np.float32 if counts.sum() < 1 << 24 else np.float64
+    bits = _mask_bits(masks, width, dtype)
+    weight = bits.sum(axis=1)
+    single = weight == 1
+    linear = counts[single].astype(dtype) @ bits[single]
+    return linear, bits[weight > 1], counts[weight > 1].astype(dtype)
+
+
+def _histogram_scores(split, selections):
+    # selections is a (subsets x offsets) 0/1 matrix; a mask hits a subset if
+    # popcount(mask & subset) > 0, i.e. if the bit product clipped to 1 is 1.
+    linear, bits, counts = split
+    hits = bits @ selections.T.astype(bits.dtype)
+    np.minimum(hits, 1, out=hits)
+    return selections @ linear + counts @ hits
+
+
+def iter_families(pool_size, size, chunk_size=1 << 12):
+    """
+    Yields every subset of `size` pool indices, as (chunk_size x size) arrays of
+    ascending indices in lexicographic order.
+    """
+    combinations = itertools.combinations(range(pool_size), size)
+    while True:
+        chunk = np.array(list(itertools.islice(combinations, chunk_size)), dtype=np.int64).reshape(-1, size)
+        if not len(chunk):
+            return
+        yield chunk
+
+
+# Family scores, in the order they are returned by rank_families.
+SCORES = ("yield", "unique", "coverage")
+
+
+def rank_families(totals, p_histogram, q_histogram, size, top=20, rank_by="unique", chunk_size=1 << 12):
+    """
+    Scores every subset of `size` offsets from the pool and returns the `top`
+    best as (families, scores): an array of pool index tuples and a matching
+    array with one column per entry of SCORES. Ties on `rank_by` are broken
+    by the other scores, then by the earlier family.
+    """
+    if rank_by not in SCORES:
+        raise ValueError(f"unknown family score '{rank_by}'")
+    width = len(totals)
+    if not 1 <= size <= width:
+        raise ValueError(f"family size must be between 1 and the pool size {width}")
+    p_split = _split_histogram(*p_histogram, width)
+    q_split = _split_histogram(*q_histogram, width)
+    totals = np.asarray(totals, dtype=np.float64)
+    order = [SCORES.index(rank_by)] + [index for index in range(len(SCORES)) if SCORES[index] != rank_by]
+
+    best_families = np.zeros((0, size), dtype=np.int64)
+    best_scores = np.zeros((0, len(SCORES)), dtype=np.int64)
+    for families in iter_families(width, size, chunk_size):
+        selections = np.zeros((len(families), width), dtype=np.float32)
+        np.put_along_axis(selections, families, 1, axis=1)
+        scores = np.column_stack([selections.astype(np.float64) @ totals, _histogram_scores(q_split, selections),
+                                  _histogram_scores(p_split, selections)]).round().astype(np.int64)
+
+        best_families = np.concatenate([best_families, families])
+        best_scores = np.concatenate([best_scores, scores])
+        # np.lexsort sorts by its last key first; the stable sort keeps earlier families ahead on ties.
+        keep = np.lexsort([-best_scores[:, column] for column in reversed(order)])[:top]
+        keep.sort()
+        best_families, best_scores = best_families[keep], best_scores[keep]
+
+    final = np.lexsort([-best_scores[:, column] for column in reversed(order)])
+    return best_families[final], best_scores[final]
+
+
+def family_count(pool_size, size):
+    """
+    Returns the number of families of `size` offsets in a pool of `pool_size`.
+    """
+    return math.comb(pool_size, size)
@@ -0,0 +1,184 @@
+import argparse
+import csv
+import struct
+from collections import namedtuple
+
+import numpy as np
+
+from affine_forms import AffineForm, as_form, form_label
+from offset_analysis import mask_dtype, popcount, q_matrix
+
+# Compact columnar alternative to the per-pair main table CSV.
+#
+# Layout (all little-endian):
+#   header   magic (8 bytes), version (u8), mask width in bytes (u8),
+#            number of offsets (u16), number of rows (u64),
+#            the offsets (i32 each), zero padding up to a multiple of 8 bytes
+#            (version 2, for affine forms: an (a, b, partner) i32 triple per form)
+#   p        u64 per row
+#   mask     one unsigned integer of `mask width` bytes per row; bit j is set
+#            if 2p + offsets[j] (or form j) is prime
+#   category u8 per row: the last digit of p
+#
+# Every column starts on a boundary suited to its type, so the loader can hand
+# them back as zero-copy views of one memory map. Prime values are recomputed
+# from p and the offsets; success counts are a popcount of the mask. Run as a
+# script, it summarizes a table and can export it as the per-pair CSV.
+
+MAGIC = b"TPOFFTAB"
+VERSION = 1
+FORMS_VERSION = 2
+_HEADER = struct.Struct("<8sBBHQ")
+
+OffsetTable = namedtuple("OffsetTable", ["offsets", "p", "mask", "category"])
+
+
+def _header_size(offset_count, version=VERSION):
+    size = _HEADER.size + 4 * offset_count * (3 if version == FORMS_VERSION else 1)
+    return size + (-size % 8)
+
+
+def _encode_offsets(offsets):
+    # Plain integer offsets keep the version 1 layout; any affine form switches to triples.
+    if all(isinstance(offset, int) for offset in offsets):
+        return VERSION, np.asarray(offsets, dtype="<i4")
+    return FORMS_VERSION, np.array([as_form(offset) for offset in offsets], dtype="<i4").reshape(-1, 3)
+
+
+def _decode_offsets(data, start, offset_count, version):
+    if version == VERSION:
+        return np.frombuffer(data, dtype="<i4", count=offset_count, offset=start).tolist()
+    triples = np.frombuffer(data, dtype="<i4", count=3 * offset_count, offset=start)
+    return [AffineForm(a, b, bool(partner)) for a, b, partner in triples.reshape(-1, 3).tolist()]
+
+
+def write_offset_table(file_name, offsets, p_chunks, mask_chunks, category_chunks=None):
+    """
+    Writes the columnar table from matching sequences of p and mask arrays, and
+    optionally of last digits (otherwise they are computed from p).
+    The chunks are streamed column by column, so no column is ever concatenated in memory.
+    """
+    masks_dtype = mask_dtype(len(offsets))
+    rows = sum(len(chunk) for chunk in p_chunks)
+    version, encoded = _encode_offsets(offsets)
+    header_size = _header_size(len(offsets), version)
+
+    with open(file_name, 'wb') as table_file:
+        table_file.write(_HEADER.pack(MAGIC, version, masks_dtype.itemsize, len(offsets), rows))
+        table_file.write(encoded.tobytes())
+        table_file.write(bytes(header_size - _HEADER.size - encoded.nbytes))
+        for chunk in p_chunks:
+            table_file.write(np.asarray(chunk, dtype="<u8").tobytes())
+        for chunk in mask_chunks:
+            table_file.write(np.asarray(chunk, dtype=masks_dtype).tobytes())
+        if category_chunks is None:
+            category_chunks = (np.asarray(chunk, dtype="<u8") % 10 for chunk in p_chunks)
+        for chunk in category_chunks:
+            table_file.write(np.asarray(chunk, dtype=np.uint8).tobytes())
+
+
+def rechunk(chunks, size):
+    """
+    Regroups a stream of arrays into arrays of exactly `size` entries (the last may be shorter).
+    """
+    buffered, buffered_rows = [], 0
+    for chunk in chunks:
+        while len(chunk):
+            part = chunk[:size - buffered_rows]
+            buffered.append(part)
+            buffered_rows += len(part)
+            chunk = chunk[len(part):]
+            if buffered_rows == size:
+                yield np.concatenate(buffered)
+                buffered, buffered_rows = [], 0
+    if buffered_rows:
+        yield np.concatenate(buffered)
+
+
+def load_offset_table(file_name):
+    """
+    Memory-maps a columnar table and returns it as an OffsetTable whose
+    p, mask and category columns are zero-copy NumPy views of the file.
+    """
+    data = np.memmap(file_name, dtype=np.uint8, mode='r')
+    magic, version, mask_width, offset_count, rows = _HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version not in (VERSION, FORMS_VERSION):
+        raise ValueError(f"'{file_name}' is not a version {VERSION} or {FORMS_VERSION} offset table")
+
+    offsets = _decode_offsets(data, _HEADER.size, offset_count, version)
+    p_start = _header_size(offset_count, version)
+    mask_start = p_start + 8 * rows
+    category_start = mask_start + mask_width * rows
+    if len(data) != category_start + rows:
+        raise ValueError(f"'{file_name}' is truncated or has trailing data")
+
+    return OffsetTable(
+        offsets,
+        data[p_start:mask_start].view("<u8"),
+        data[mask_start:category_start].view(f"<u{mask_width}"),
+        data[category_start:],
+    )
+
+
+def table_success_counts(table, rows=slice(None)):
+    """
+    Returns the success count of the selected rows (the popcount of their masks).
+    """
+    return popcount(table.mask[rows])
+
+
+def table_prime_values(table, rows=slice(None)):
+    """
+    Recomputes the q-values 2p + offset (or a * p + b) for the selected rows.
+    Returns an int64 matrix with one column per offset, holding 0 where q is not prime.
+    """
+    p = np.asarray(table.p[rows], dtype=np.int64)
+    mask = np.asarray(table.mask[rows])
+    q = q_matrix(p, table.offsets)
+    bits = (mask[:, None] >> np.arange(len(table.offsets), dtype=mask.dtype)[None, :]) & 1
+    return np.where(bits == 1, q, 0)
+
+
+# Rows formatted per chunk by write_table_csv.
+_CSV_CHUNK_ROWS = 1 << 16
+
+
+def write_table_csv(file_name, table, chunk_rows=_CSV_CHUNK_ROWS):
+    """
+    Writes the table in the layout of the per-pair main table CSV (as in
+    archive/twin_prime_offsets_v2.csv): p, p + 2, the last digits of the pair,
+    an is_prime and a prime_value column per offset, and the success count.
+    Rows are formatted a chunk at a time, so the table is never expanded in memory.
+    """
+    labels = [form_label(offset) for offset in table.offsets]
+    headers = (["p", "p+2", "last_digit_category"] + [f"{label}_is_prime" for label in labels]
+               + [f"{label}_prime_value" for label in labels] + ["success_count"])
+    with open(file_name, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(headers)
+        for first in range(0, len(table.p), chunk_rows):
+            rows = slice(first, first + chunk_rows)
+            values = table_prime_values(table, rows).tolist()
+            for p, digit, row_values, count in zip(table.p[rows].tolist(), table.category[rows].tolist(), values,
+                                                   table_success_counts(table, rows).tolist()):
+                writer.writerow([p, p + 2, f"({digit},{(digit + 2) % 10})"] + [value != 0 for value in row_values]
+                                + [value or "" for value in row_values] + [count])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize a columnar main table, or export it as the per-pair CSV.")
+    parser.add_argument("table", help="main table file (written by '7offsets_all reports.py --main-table')")
+    parser.add_argument("--csv", metavar="FILE", help="write the table in the per-pair main table CSV layout")
+    args = parser.parse_args()
+
+    # 1. Load the table and print its success count distribution.
+    table = load_offset_table(args.table)
+    print(f"'{args.table}': {len(table.p):,} twin primes, offsets {' '.join(form_label(offset) for offset in table.offsets)}")
+    distribution = np.bincount(table_success_counts(table), minlength=len(table.offsets) + 1)
+    for successes, count in enumerate(distribution.tolist()):
+        print(f"  {successes} offsets succeeded: {count:,}")
+
+    # 2. Export the per-pair CSV.
+    if args.csv:
+        write_table_csv(args.csv, table)
+        print(f"Per-pair CSV written to '{args.csv}'.")
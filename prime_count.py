@@ -0,0 +1,78 @@
+import math
+
+import numpy as np
+
+from affine_forms import multiplier_ranges
+from prime_sieve import small_primes
+
+# Prime counting without a sieve of the whole range.
+#
+# Meissel-Lehmer style methods rest on the partial sieve function
+# phi(v, a), the count of 2 <= n <= v with no prime factor among the first a
+# primes, through the recursion
+#     phi(v, a) = phi(v, a - 1) - (phi(v / p_a, a - 1) - phi(p_a - 1, a - 1)).
+# Only the values v = x // n ever appear in it, and there are fewer than
+# 2 * sqrt(x) of them, so the whole phi table is kept for those values and
+# updated one prime at a time with NumPy: once every prime up to sqrt(x) has
+# been applied, the table holds pi(v) for every v = x // n, including pi(x).
+# The work grows like x^(3/4) and the memory like sqrt(x); no sieve of [0, x]
+# is ever built.
+
+_counts = {}
+
+
+def prime_count_table(x):
+    """
+    Returns (small, large) with small[v] = pi(v) for v <= sqrt(x) and
+    large[n] = pi(x // n) for 1 <= n <= sqrt(x) (index 0 is unused).
+    """
+    root = math.isqrt(x)
+    # Before any prime is applied, phi counts every n >= 2.
+    small = np.arange(-1, root, dtype=np.int64)
+    small[0] = 0
+    quotients = np.zeros(root + 1, dtype=np.int64)
+    quotients[1:] = x // np.arange(1, root + 1, dtype=np.int64)
+    large = quotients - 1
+
+    for p in small_primes(root):
+        below = small[p - 1]
+        square = p * p
+        # large[n] -= phi(x // (n * p)) - phi(p - 1), read from large while n * p <= root.
+        stop = min(root, x // square)
+        inside = min(stop, root // p)
+        large[1:inside + 1] -= large[p:inside * p + 1:p] - below
+        # x // (n * p) == (x // n) // p
+        large[inside + 1:stop + 1] -= small[quotients[inside + 1:stop + 1] // p] - below
+        # small[v] -= phi(v // p) - phi(p - 1), for every v >= p * p.
+        if square <= root:
+            small[square:] -= small[np.arange(square, root + 1) // p] - below
+    return small, large
+
+
+def prime_count(x):
+    """
+    Returns pi(x), the number of primes <= x, in O(x^(3/4)) time and O(sqrt(x)) memory.
+    Results are cached, so repeated denominators cost nothing.
+    """
+    if x < 2:
+        return 0
+    if x not in _counts:
+        _counts[x] = int(prime_count_table(x)[1][1])
+    return _counts[x]
+
+
+def prime_share(unique_count, limit, offsets, start=0):
+    """
+    Returns the unique primes produced as a fraction of all primes in the q-ranges
+    the analysis of start <= p < limit covers: a * start + b up to a * limit + b
+    for each multiplier a, over its offsets' b (the ranges of different
+    multipliers are counted once where they overlap, and not in the gaps between them).
+    """
+    windows = sorted((max(a * start + low, 0), a * limit + high) for a, (low, high) in multiplier_ranges(offsets).items())
+    total, counted = 0, -1
+    for low, high in windows:
+        low = max(low, counted + 1)
+        if low <= high:
+            total += prime_count(high) - prime_count(low - 1)
+            counted = high
+    return unique_count / total if total > 0 else 0
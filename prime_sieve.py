@@ -0,0 +1,274 @@
+import math
+from bisect import bisect_left
+from collections import namedtuple
+from itertools import chain, compress, repeat
+
+from affine_forms import multiplier_ranges
+from instrumentation import NO_INSTRUMENTATION
+
+
+def is_prime(n, flags=None):
+    """
+    Checks if a number is prime.
+    If a sieve (`flags`) covering n is given, the answer is a single O(1) lookup.
+    Otherwise it falls back to the 6k±1 trial division method.
+    """
+    if n <= 1:
+        return False
+    if flags is not None and n < len(flags):
+        return flags[n] == 1
+    if n <= 3:
+        return True
+    if n % 2 == 0 or n % 3 == 0:
+        return False
+    i = 5
+    while i * i <= n:
+        if n % i == 0 or n % (i + 2) == 0:
+            return False
+        i += 6
+    return True
+
+
+def prime_flags(limit):
+    """
+    Builds a sieve of Eratosthenes covering [0, limit].
+    Returns a bytearray where flags[n] is 1 if n is prime, otherwise 0.
+    """
+    if limit < 1:
+        return bytearray(limit + 1)
+    flags = bytearray([1]) * (limit + 1)
+    flags[0] = flags[1] = 0
+    for i in range(2, math.isqrt(limit) + 1):
+        if flags[i]:
+            # Slice assignment crosses off every multiple of i in one C-level pass.
+            flags[i * i::i] = bytes(len(range(i * i, limit + 1, i)))
+    return flags
+
+
+def sympy_cross_check(limit, flags=None):
+    """
+    Compares a sieve (by default a fresh one) with sympy for every n <= limit.
+    Returns the numbers on which they disagree; an empty list means they agree.
+    For validation only: sympy is imported here and nowhere else.
+    """
+    from sympy import primerange
+
+    flags = flags if flags is not None else prime_flags(limit)
+    expected = bytearray(limit + 1)
+    for prime in primerange(2, limit + 1):
+        expected[prime] = 1
+    if flags[:limit + 1] == expected:
+        return []
+    return [n for n in range(limit + 1) if flags[n] != expected[n]]
+
+
+def sieve_limit(limit, offsets):
+    """
+    Returns the largest number the analysis can ask about: the q-values
+    2p + offset (or a * p + b for affine forms) for p < limit, and the twin partner p + 2.
+    """
+    return max(max(a * limit + b for a, (_, b) in multiplier_ranges(offsets).items()), limit + 1)
+
+
+def find_twin_primes(limit, flags=None):
+    """
+    Finds all twin prime pairs (p, p+2) where p is less than the specified limit.
+    Returns a list of the first term, p, for each twin prime pair.
+    """
+    if flags is None:
+        return find_twin_primes_in_range(0, limit)
+    return [p for p in wheel_candidates(0, limit) if flags[p] and flags[p + 2]]
+
+
+# Above (5, 7), every twin prime pair has p = 30k + r for one of these residues:
+# any other residue puts a multiple of 2, 3 or 5 in p or p + 2.
+WHEEL = 30
+TWIN_RESIDUES = (11, 17, 29)
+
+
+def wheel_candidates(low, high):
+    """
+    Returns the possible first terms p of a twin prime pair with low <= p < high,
+    in ascending order: 3, 5 and the numbers 30k + r for r in TWIN_RESIDUES.
+    """
+    small = [p for p in (3, 5) if low <= p < high]
+    runs = [range(_wheel_start(low, residue), high, WHEEL) for residue in TWIN_RESIDUES]
+    return small + sorted(chain(*runs))
+
+
+def _wheel_start(low, residue):
+    # The first p >= low with p = residue (mod 30).
+    return residue + max(-(-(low - residue) // WHEEL), 0) * WHEEL
+
+
+def wheel_table(base_primes):
+    """
+    Precomputes for every base prime above 5 the inverse of 30 modulo it, from
+    which wheel_twin_flags finds the k (mod prime) at which prime divides 30k + r.
+    Returns a list of (prime, inverse).
+    """
+    primes = [prime for prime in base_primes if prime > 5]
+    return list(zip(primes, [pow(WHEEL, -1, prime) for prime in primes]))
+
+
+def wheel_twin_flags(low, high, table):
+    """
+    Sieves the twin prime candidates 30k + r in [low, high), keeping one flag per
+    candidate for each residue r in TWIN_RESIDUES instead of one per number.
+    `table` is the wheel_table of every prime up to sqrt(high + 2).
+    Returns a list of (first, flags) per residue, where flags[i] is 1 if
+    p = first + 30i and p + 2 are both prime.
+    """
+    windows = []
+    for residue in TWIN_RESIDUES:
+        first = _wheel_start(low, residue)
+        k_low = first // WHEEL
+        flags = bytearray([1]) * len(range(first, high, WHEEL))
+        for prime, inverse in table:
+            if prime * prime >= high + 2:
+                break
+            for n in (residue, residue + 2):
+                # Smaller multiples of prime have a smaller factor and are struck by it.
+                k_min = max(k_low, -(-(prime * prime - n) // WHEEL))
+                k = k_min + (-n * inverse - k_min) % prime
+                if prime < len(flags):
+                    flags[k - k_low::prime] = bytes(len(range(k - k_low, len(flags), prime)))
+                elif k - k_low < len(flags):
+                    # A prime wider than the window strikes it at most once.
+                    flags[k - k_low] = 0
+        windows.append((first, flags))
+    return windows
+
+
+def wheel_twin_primes(low, high, table):
+    """
+    Finds the twin prime pairs with low <= p < high on the mod 30 wheel.
+    Returns two matching lists: the first terms p in ascending order and their
+    residues p % 30 (whose last digit is also the last digit of p).
+    """
+    small = [(p, p) for p in (3, 5) if low <= p < high]
+    tagged = [zip(compress(range(first, high, WHEEL), flags), repeat(residue))
+              for residue, (first, flags) in zip(TWIN_RESIDUES, wheel_twin_flags(low, high, table))]
+    pairs = small + sorted(chain(*tagged))
+    return [p for p, _ in pairs], [residue for _, residue in pairs]
+
+
+def segment_twin_primes(low, high, base_primes):
+    """
+    Same as wheel_twin_primes, but sieves every number of the window with
+    segment_flags and needs no wheel table. Cheaper for windows that are narrow
+    next to the number of base primes, which then mostly strike it at most once.
+    """
+    flags = segment_flags(low, high + 2, base_primes)
+    twin_ps = [p for p in wheel_candidates(low, high) if flags[p - low] and flags[p + 2 - low]]
+    return twin_ps, [p % WHEEL for p in twin_ps]
+
+
+# Blocks narrower than this many numbers per sieving prime skip the wheel for
+# segment_flags: the wheel pays six strikes per prime and only wins once most
+# primes hit the block several times (measured break-even: about 90).
+WHEEL_MIN_WIDTH_PER_PRIME = 100
+
+# Segment width for the segmented sieve: 256 KiB of flags stays resident in a typical L2 cache.
+SEGMENT_SIZE = 1 << 18
+
+
+def small_primes(limit):
+    """
+    Returns a list of all primes up to and including limit.
+    """
+    return list(compress(range(limit + 1), prime_flags(limit)))
+
+
+def segment_flags(low, high, base_primes):
+    """
+    Sieves the window [low, high) using the given base primes, which must
+    include every prime up to sqrt(high).
+    Returns a bytearray where flags[n - low] is 1 if n is prime, otherwise 0.
+    """
+    flags = bytearray([1]) * (high - low)
+    for n in range(low, min(high, 2)):
+        flags[n - low] = 0
+    for prime in base_primes:
+        if prime * prime >= high:
+            break
+        start = max(prime * prime, (low + prime - 1) // prime * prime)
+        flags[start - low::prime] = bytes(len(range(start, high, prime)))
+    return flags
+
+
+# One segment of the walk over p-values: the twin primes with low <= p < high
+# and the sieved q-window for them (see iter_twin_prime_segments).
+TwinSegment = namedtuple("TwinSegment", ["low", "high", "twin_ps", "residues", "q_windows"])
+
+
+def iter_twin_prime_segments(limit, offsets, segment_size=SEGMENT_SIZE, start=0, sieve_q=True,
+                             instrumentation=NO_INSTRUMENTATION):
+    """
+    Walks the twin primes with start <= p < limit one segment of p-values at a
+    time, so memory stays bounded no matter how large the limit is. Only the
+    window [start, limit) is sieved, seeded with the primes up to its square
+    root, so the cost follows the width of the window rather than the limit.
+
+    For every segment it yields a TwinSegment:
+    - low, high: the segment covers start <= low <= p < high <= limit.
+    - twin_ps: the first term p of each twin prime pair in the segment.
+    - residues: p % 30 for each of them (11, 17 or 29 apart from p = 3 and 5),
+      which also gives the last digit of p.
+    - q_windows: for each multiplier a among the offsets (2 for plain offsets,
+      see affine_forms.py) a sieved window (q_low, q_flags) covering every
+      q = a * p + b for the segment, where q is prime if q >= q_low and
+      q_flags[q - q_low] is 1. With sieve_q=False it is empty.
+    The twin primes are sieved on the mod 30 wheel, one flag per candidate
+    residue instead of one per number, except in blocks too narrow for the wheel
+    to pay off (see WHEEL_MIN_WIDTH_PER_PRIME), which are sieved plainly. The
+    small-prime table is built once and the wheel table on first use, and both
+    are carried between segments. Twin detection and q-window sieving are timed
+    on `instrumentation` (see instrumentation.py).
+    """
+    base_primes = small_primes(math.isqrt(sieve_limit(limit, offsets) if sieve_q else limit + 1))
+    table = None
+
+    # High up, most base primes hit a segment at most once; widen the segments
+    # so walking the base-prime table stays cheap next to the sieving itself.
+    segment_size = max(segment_size, 16 * len(base_primes))
+    # The wheel keeps one flag per 10 numbers, so it sieves blocks of ten
+    # segments at a time for the memory of one.
+    block_size = segment_size * WHEEL // len(TWIN_RESIDUES)
+
+    block_low = start
+    while block_low < limit:
+        block_high = min(block_low + block_size, limit)
+        with instrumentation.timer("twin_detection"):
+            sieving_primes = bisect_left(base_primes, math.isqrt(block_high + 1) + 1)
+            if block_high - block_low < WHEEL_MIN_WIDTH_PER_PRIME * sieving_primes:
+                block_ps, block_residues = segment_twin_primes(block_low, block_high, base_primes)
+            else:
+                if table is None:
+                    table = wheel_table(base_primes)
+                block_ps, block_residues = wheel_twin_primes(block_low, block_high, table)
+
+        for low in range(block_low, block_high, segment_size):
+            high = min(low + segment_size, block_high)
+            first, stop = bisect_left(block_ps, low), bisect_left(block_ps, high)
+            twin_ps, residues = block_ps[first:stop], block_residues[first:stop]
+
+            q_windows = {}
+            if sieve_q:
+                with instrumentation.timer("sieve_segments"):
+                    for a, (b_low, b_high) in multiplier_ranges(offsets).items():
+                        q_low = max(a * low + b_low, 0)
+                        q_high = max(a * (high - 1) + b_high + 1, q_low)
+                        q_windows[a] = (q_low, segment_flags(q_low, q_high, base_primes))
+
+            yield TwinSegment(low, high, twin_ps, residues, q_windows)
+        block_low = block_high
+
+
+def find_twin_primes_in_range(start, stop):
+    """
+    Finds all twin prime pairs (p, p+2) with start <= p < stop, sieving only that window.
+    Returns a list of the first term, p, for each twin prime pair.
+    """
+    return [p for segment in iter_twin_prime_segments(stop, [0], start=start, sieve_q=False)
+            for p in segment.twin_ps]
@@ -0,0 +1,362 @@
+import argparse
+import asyncio
+import ipaddress
+import json
+from functools import lru_cache
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+import miller_rabin
+from affine_forms import coefficients, parse_offsets
+from offset_analysis import cumulative_counts, offset_label, popcount, q_matrix
+from offset_reports import LastDigitReport
+from sieve_cache import SieveCache
+from twin_index import TwinIndex
+
+# A small local service answering offset queries from precomputed results.
+#
+# It loads a twin prime index (see twin_index.py) once, and optionally a sieve
+# cache (see sieve_cache.py), and serves JSON over HTTP on a loopback address or a
+# Unix socket. At startup every block of the index is summarised into running
+# totals: success-count histograms, and pairs and per-offset successes by last digit.
+# A range aggregate is then the difference of two running totals plus at most
+# two partially covered blocks, whatever the width of the range. Results are kept
+# in an LRU cache. Primality questions arriving within a couple of milliseconds
+# of each other are tested together in one vectorized call.
+#
+#   GET  /distribution?low=A&high=B   exact and cumulative success counts for A <= p < B
+#   GET  /digits?low=A&high=B         per-offset successes by last digit of p
+#   GET  /primality?p=P1,P2&offsets=1,-3   whether each q = 2p + b (or form) is prime
+#   GET  /count?low=A&high=B, /rank?x=X, /select?k=K
+#   GET  /stats                       cache and request counters
+#   POST /batch                       [{"path": "/digits", "params": {"low": ..}}, ...]
+
+DEFAULT_PORT = 8765
+
+# Distinct range results kept in the LRU cache.
+CACHE_SIZE = 4096
+
+# How long a primality request waits for others to share its batch, in seconds.
+BATCH_DELAY = 0.002
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 500: "Internal Server Error"}
+
+
+def _running_totals(rows):
+    # Prepends a zero row and accumulates along the first axis.
+    return np.concatenate([np.zeros((1,) + rows.shape[1:], dtype=np.int64), np.cumsum(rows, axis=0, dtype=np.int64)])
+
+
+class OffsetQueries:
+    """
+    The query logic of the service, usable without the server: range aggregates
+    over a TwinIndex (cached) and primality of q-values.
+    """
+
+    def __init__(self, index_file, sieve_cache=None, cache_size=CACHE_SIZE):
+        self.index = TwinIndex(index_file)
+        self.offsets = self.index.offsets
+        self.sieve_cache = SieveCache(sieve_cache) if sieve_cache else None
+
+        # Per-block totals, kept as running sums over the blocks.
+        blocks = [self._aggregate_rows(self.index.block(block), np.asarray(self.index.mask[rows]))
+                  for block, rows in enumerate(self._block_rows())]
+        n = len(self.offsets)
+        self.histogram_totals = _running_totals(np.array([block[0] for block in blocks]).reshape(-1, n + 1))
+        self.pair_totals = _running_totals(np.array([block[1] for block in blocks]).reshape(-1, 10))
+        self.success_totals = _running_totals(np.array([block[2] for block in blocks]).reshape(-1, 10, n))
+
+        self.aggregate = lru_cache(maxsize=cache_size)(self._aggregate)
+
+    def _block_rows(self):
+        block_rows = self.index.block_rows
+        return [slice(start, min(start + block_rows, self.index.rows)) for start in range(0, self.index.rows, block_rows)]
+
+    def _aggregate_rows(self, p, masks):
+        """
+        Returns (success-count histogram, pairs by last digit, successes by last digit and offset) for some rows.
+        """
+        n = len(self.offsets)
+        bits = (masks[:, None] >> np.arange(n, dtype=masks.dtype)[None, :]) & 1 == 1
+        digits = p % 10
+        histogram = np.bincount(popcount(masks), minlength=n + 1)
+        pairs = np.bincount(digits, minlength=10)
+        successes = np.bincount((digits[:, None] * n + np.arange(n))[bits], minlength=10 * n).reshape(10, n)
+        return histogram, pairs, successes
+
+    def _aggregate(self, low, high):
+        # The blocks fully inside the rows come from the running totals, the partial ones are decoded.
+        first, stop = self.index.rank(low), self.index.rank(high)
+        stop = max(stop, first)
+        block_rows = self.index.block_rows
+        first_full, stop_full = min(-(-first // block_rows), stop // block_rows), stop // block_rows
+        histogram = self.histogram_totals[stop_full] - self.histogram_totals[first_full]
+        pairs = self.pair_totals[stop_full] - self.pair_totals[first_full]
+        successes = self.success_totals[stop_full] - self.success_totals[first_full]
+        edges = [(first, min(first_full * block_rows, stop)), (max(stop_full * block_rows, first), stop)]
+        for edge_first, edge_stop in edges:
+            if edge_first < edge_stop:
+                block = edge_first // block_rows
+                p = self.index.block(block)[edge_first - block * block_rows:edge_stop - block * block_rows]
+                edge = self._aggregate_rows(p, np.asarray(self.index.mask[edge_first:edge_stop]))
+                histogram, pairs, successes = histogram + edge[0], pairs + edge[1], successes + edge[2]
+        return histogram, pairs, successes
+
+    def _bounds(self, low, high):
+        last = self.index.select(self.index.rows - 1) if self.index.rows else 0
+        return (0 if low is None else low), (last + 1 if high is None else high)
+
+    def distribution(self, low=None, high=None):
+        """
+        Returns the exact and cumulative success-count distribution for low <= p < high.
+        """
+        low, high = self._bounds(low, high)
+        histogram = self.aggregate(low, high)[0]
+        return {'low': low, 'high': high, 'pairs': int(histogram.sum()), 'exact': histogram.tolist(),
+                'at_least': cumulative_counts(histogram).tolist()}
+
+    def digits(self, low=None, high=None):
+        """
+        Returns the pairs and per-offset successes by last digit of p for low <= p < high,
+        in the categories of LastDigitReport.
+        """
+        low, high = self._bounds(low, high)
+        _, pairs, successes = self.aggregate(low, high)
+        categories = {}
+        for digit, label in sorted(LastDigitReport.labels.items()):
+            categories[str(digit)] = {
+                'label': label, 'pairs': int(pairs[digit]), 'primes_produced': int(successes[digit].sum()),
+                'successes': {offset_label(offset): int(count) for offset, count in zip(self.offsets, successes[digit])},
+            }
+        return {'low': low, 'high': high, 'categories': categories}
+
+    def are_prime(self, values):
+        """
+        Tests an array of values, from the sieve cache if it covers them and with Miller-Rabin otherwise.
+        """
+        values = np.asarray(values, dtype=np.int64)
+        if self.sieve_cache is not None and (values.size == 0 or values.max() < self.sieve_cache.limit):
+            return self.sieve_cache.are_prime(values)
+        return miller_rabin.are_prime(np.maximum(values, 0))
+
+
+class _PrimalityBatcher:
+    """
+    Collects the values of concurrent primality requests for BATCH_DELAY
+    seconds and tests them in one call.
+    """
+
+    def __init__(self, are_prime, delay=BATCH_DELAY):
+        self.test = are_prime
+        self.delay = delay
+        self.pending = []
+        self.batches = 0
+
+    async def are_prime(self, values):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((values, future))
+        if len(self.pending) == 1:
+            loop.call_later(self.delay, self._flush)
+        return await future
+
+    def _flush(self):
+        pending, self.pending = self.pending, []
+        self.batches += 1
+        try:
+            results = self.test(np.concatenate([values.ravel() for values, _ in pending]))
+        except Exception as error:
+            for _, future in pending:
+                future.set_exception(error)
+            return
+        start = 0
+        for values, future in pending:
+            future.set_result(results[start:start + values.size].reshape(values.shape))
+            start += values.size
+
+
+def _int_param(params, name, optional=False):
+    if params.get(name) in (None, ""):
+        if optional:
+            return None
+        raise ValueError(f"missing parameter '{name}'")
+    try:
+        return int(params[name])
+    except (TypeError, ValueError):  # e.g. a list or an object in a /batch query
+        raise ValueError(f"parameter '{name}' must be an integer") from None
+
+
+class QueryServer:
+    """
+    Serves OffsetQueries as JSON over HTTP/1.1 (keep-alive, GET and POST only).
+    """
+
+    def __init__(self, queries):
+        self.queries = queries
+        self.batcher = _PrimalityBatcher(queries.are_prime)
+        self.requests = 0
+        self.routes = {
+            "/distribution": self._distribution, "/digits": self._digits, "/primality": self._primality,
+            "/count": self._count, "/rank": self._rank, "/select": self._select, "/stats": self._stats,
+        }
+
+    async def _distribution(self, params):
+        return self.queries.distribution(_int_param(params, 'low', True), _int_param(params, 'high', True))
+
+    async def _digits(self, params):
+        return self.queries.digits(_int_param(params, 'low', True), _int_param(params, 'high', True))
+
+    async def _primality(self, params):
+        # A comma-separated string in a URL, or a list in a /batch query.
+        p_values = params.get('p', "")
+        if isinstance(p_values, str):
+            p_values = [value for value in p_values.split(",") if value.strip()]
+        try:
+            p = np.array([int(value) for value in p_values], dtype=np.int64)
+        except (TypeError, ValueError):
+            raise ValueError("parameter 'p' must be a comma-separated list of integers") from None
+        except OverflowError:
+            raise ValueError("parameter 'p' must hold integers below 2**63") from None
+        offsets = parse_offsets(params['offsets']) if params.get('offsets') else self.queries.offsets
+        # q is computed in int64, so every a * p + b must fit (checked with Python ints).
+        if len(p) and any(not -(1 << 63) <= a * value + b < 1 << 63
+                          for a, b in map(coefficients, offsets) for value in (int(p.min()), int(p.max()))):
+            raise ValueError("every q = a * p + b must lie in [-2**63, 2**63)")
+        q = q_matrix(p, offsets)
+        prime = await self.batcher.are_prime(q)
+        return {'p': p.tolist(), 'offsets': [offset_label(offset) for offset in offsets],
+                'q': q.tolist(), 'prime': prime.tolist()}
+
+    async def _count(self, params):
+        return {'count': self.queries.index.count(_int_param(params, 'low'), _int_param(params, 'high'))}
+
+    async def _rank(self, params):
+        return {'rank': self.queries.index.rank(_int_param(params, 'x'))}
+
+    async def _select(self, params):
+        return {'p': self.queries.index.select(_int_param(params, 'k'))}
+
+    async def _stats(self, params):
+        info = self.queries.aggregate.cache_info()
+        return {'requests': self.requests, 'cache_hits': info.hits, 'cache_misses': info.misses,
+                'cache_entries': info.currsize, 'primality_batches': self.batcher.batches,
+                'twin_primes': self.queries.index.rows}
+
+    async def answer(self, path, params):
+        """
+        Returns (status, JSON-ready payload) for one query.
+        """
+        if not isinstance(path, str) or path not in self.routes:
+            return 404, {'error': f"unknown query '{path}'", 'queries': sorted(self.routes) + ["/batch"]}
+        if not isinstance(params, dict):
+            return 400, {'error': "'params' must be a JSON object"}
+        try:
+            return 200, await self.routes[path](params)
+        except (ValueError, IndexError, TypeError) as error:
+            return 400, {'error': str(error)}
+        except OverflowError:
+            return 400, {'error': "integer parameters must be below 2**63"}
+
+    async def _batch_entry(self, query):
+        # Every entry gets a result in its place, so results line up with the queries.
+        if not isinstance(query, dict):
+            return 400, {'error': "each /batch entry must be a JSON object {\"path\": ..., \"params\": {...}}"}
+        return await self.answer(query.get('path'), query.get('params', {}))
+
+    async def _batch(self, body):
+        try:
+            queries = json.loads(body or b"[]")
+            if not isinstance(queries, list):
+                raise ValueError
+        except ValueError:
+            return 400, {'error': "/batch expects a JSON list of {\"path\": ..., \"params\": {...}}"}
+        results = await asyncio.gather(*[self._batch_entry(query) for query in queries])
+        return 200, [dict(payload, status=status) if isinstance(payload, dict) else payload for status, payload in results]
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, _ = request_line.decode('latin-1').split(" ", 2)
+                headers = {}
+                while (line := await reader.readline()).strip():
+                    name, _, value = line.decode('latin-1').partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                self.requests += 1
+                url = urlsplit(target)
+                try:
+                    if method == "POST" and url.path == "/batch":
+                        status, payload = await self._batch(body)
+                    elif method == "GET":
+                        status, payload = await self.answer(url.path, {name: values[-1] for name, values in parse_qs(url.query).items()})
+                    else:
+                        status, payload = 405, {'error': f"{method} {url.path} is not supported"}
+                except Exception as error:  # a bug must not cost the client its response
+                    status, payload = 500, {'error': f"{type(error).__name__}: {error}"}
+
+                data = json.dumps(payload).encode()
+                writer.write(f"HTTP/1.1 {status} {_REASONS[status]}\r\nContent-Type: application/json\r\n"
+                             f"Content-Length: {len(data)}\r\n\r\n".encode() + data)
+                await writer.drain()
+                if headers.get('connection', "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+
+def check_loopback(host):
+    """
+    Raises ValueError unless host is a loopback address: the service is local only.
+    """
+    if host == "localhost":
+        return
+    try:
+        if ipaddress.ip_address(host).is_loopback:
+            return
+    except ValueError:
+        pass
+    raise ValueError(f"'{host}' is not a loopback address; the service only listens on localhost")
+
+
+async def serve(queries, host="127.0.0.1", port=DEFAULT_PORT, unix_socket=None):
+    """
+    Runs the service until cancelled, on a Unix socket if one is given and on host:port otherwise.
+    """
+    server = QueryServer(queries)
+    if unix_socket is not None:
+        listener = await asyncio.start_unix_server(server.handle, unix_socket)
+    else:
+        check_loopback(host)
+        listener = await asyncio.start_server(server.handle, host, port)
+    async with listener:
+        await listener.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve offset queries from a precomputed twin prime index on localhost.")
+    parser.add_argument("index", help="twin prime index file (see '7offsets_all reports.py --twin-index')")
+    parser.add_argument("--sieve-cache", metavar="FILE", help="sieve cache file for primality queries (default: Miller-Rabin)")
+    parser.add_argument("--host", default="127.0.0.1", help="loopback address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"port to listen on (default: {DEFAULT_PORT})")
+    parser.add_argument("--unix-socket", metavar="PATH", help="listen on a Unix socket instead of a TCP port")
+    parser.add_argument("--cache-size", type=int, default=CACHE_SIZE, help=f"range results kept in memory (default: {CACHE_SIZE})")
+    args = parser.parse_args()
+    try:
+        check_loopback(args.host)
+    except ValueError as error:
+        parser.error(str(error))
+
+    queries = OffsetQueries(args.index, args.sieve_cache, args.cache_size)
+    where = args.unix_socket or f"http://{args.host}:{args.port}"
+    print(f"Serving {queries.index.rows:,} twin primes from '{args.index}' on {where}")
+    try:
+        asyncio.run(serve(queries, args.host, args.port, args.unix_socket))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,100 @@
+import copy
+import os
+import pickle
+
+from affine_forms import form_label
+from instrumentation import NO_INSTRUMENTATION
+from offset_analysis import report_key, run_offset_pipeline
+from sieve_cache import DEFAULT_CACHE_FILE
+
+
+def _clone(report, spill_dir=None):
+    # Reports that own files on disk (the all-primes spill) know how to copy themselves.
+    if hasattr(report, 'clone'):
+        return report.clone(spill_dir)
+    return copy.deepcopy(report)
+
+
+def _offset_key(offset):
+    # Plain offsets keep their historical file names; forms are named by their label.
+    return str(offset) if isinstance(offset, int) else form_label(offset)
+
+
+class ResultsStore:
+    """
+    A persistent store of finished report aggregates, one file per offset set.
+    Each file maps every limit already processed to the reports computed up to it,
+    so a run at a higher limit only has to evaluate the new interval.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _file_name(self, offsets):
+        return os.path.join(self.directory, "offsets_" + "_".join(_offset_key(offset) for offset in offsets) + ".pkl")
+
+    def _entries(self, offsets):
+        if not os.path.exists(self._file_name(offsets)):
+            return {}
+        with open(self._file_name(offsets), 'rb') as store_file:
+            return pickle.load(store_file)
+
+    def covered_limit(self, offsets, limit, reports):
+        """
+        Returns the largest stored limit <= limit that has all of the reports,
+        each with the same type and parameters, or 0.
+        """
+        keys = [report_key(report) for report in reports]
+        return max((stored_limit for stored_limit, stored in self._entries(offsets).items()
+                    if stored_limit <= limit and all(key in stored for key in keys)), default=0)
+
+    def load(self, offsets, limit, reports):
+        """
+        Merges the stored results of the largest covered limit <= limit into the
+        (empty) reports and returns that limit, or 0 if nothing usable is stored.
+        """
+        covered = self.covered_limit(offsets, limit, reports)
+        if covered:
+            stored = self._entries(offsets)[covered]
+            for report in reports:
+                report.merge(_clone(stored[report_key(report)]))
+        return covered
+
+    def save(self, offsets, limit, reports):
+        """
+        Records copies of the reports as the results up to `limit`.
+        """
+        entries = self._entries(offsets)
+        stored = entries.setdefault(limit, {})
+        for report in reports:
+            replaced = stored.get(report_key(report))
+            if getattr(replaced, 'spill_name', None) is not None:
+                os.remove(replaced.spill_name)
+            stored[report_key(report)] = _clone(report, self.directory)
+
+        temporary_name = self._file_name(offsets) + ".tmp"
+        with open(temporary_name, 'wb') as store_file:
+            pickle.dump(entries, store_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_name, self._file_name(offsets))
+
+
+def run_incremental(store, limit, offsets, reports, workers=1, checkpoint=None, resume=False, primality="sieve",
+                    sieve_cache=DEFAULT_CACHE_FILE, instrumentation=NO_INSTRUMENTATION):
+    """
+    Runs the offset pipeline up to `limit`, reusing the largest limit already in
+    the store: only the interval (covered_limit, limit) is sieved and evaluated,
+    and the extended results are saved back. A limit the store already covers
+    returns immediately. Returns the reports.
+    """
+    covered = 0
+    # A checkpoint of an interrupted incremental run already holds the stored results.
+    if not (resume and checkpoint is not None and os.path.exists(checkpoint)):
+        covered = store.load(offsets, limit, reports)
+        if covered == limit:
+            return reports
+    run_offset_pipeline(limit, offsets, reports, workers, checkpoint, resume, start=covered, primality=primality,
+                        sieve_cache=sieve_cache, instrumentation=instrumentation)
+    with instrumentation.timer("store_save"):
+        store.save(offsets, limit, reports)
+    return reports
@@ -0,0 +1,358 @@
+import argparse
+import math
+import mmap
+import os
+import struct
+import time
+import zlib
+from contextlib import contextmanager
+
+import numpy as np
+
+from affine_forms import coefficients, form_label, parse_offsets
+from prime_sieve import SEGMENT_SIZE, TwinSegment, sieve_limit, small_primes
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows; the cache is then unlocked
+    fcntl = None
+
+# A persistent sieve shared by every run and every worker process.
+#
+# The file holds one bit per odd number, bit n // 2 set if the odd number n is
+# prime (bit-packed little-endian, so a billion numbers take 62.5 MB), behind a
+# header with the number of values covered and a CRC-32 of the bits. It is opened
+# with mmap, so concurrent processes read the same page-cached copy without
+# loading or copying it, and a repeat run starts with a checksum pass instead of
+# a sieve. Asking for a larger limit extends the file in place: the new range
+# is sieved in segments and appended under an exclusive lock, and the checksum
+# is carried on from the old one. Readers hold a shared lock while they open
+# and verify, and their mappings stay valid while the file grows.
+# A file with a bad header or checksum is detected and rebuilt.
+#
+# Twin detection and counting work on the bits 64 at a time. With bit i
+# standing for 2i + 1, p and p + 2 are neighbouring bits, so the twin bitmap is
+# the sieve ANDed with itself shifted down one bit:
+#     twins = w & ((w >> 1) | (next_w << 63))
+# For an offset b (any form 2p + b), q = 2p + b sits at bit 2i + (b + 1) / 2,
+# i.e. at the even or odd bits of the sieve shifted by a constant. Splitting the
+# sieve words into their even and odd bits turns every offset into one more
+# shifted AND, and the totals are popcounts of the results, so counting needs
+# no array of p-values at all. (The per-pair offset matrix of the pipeline still
+# looks its few q-values up with are_prime: with one twin per ~150 bits high up,
+# that beats building whole shifted bitmaps per segment.)
+
+DEFAULT_CACHE_FILE = "twin_prime_sieve.cache"
+
+MAGIC = b"TWINSIEV"
+VERSION = 1
+_HEADER = struct.Struct("<8sIQQI")  # magic, version, numbers covered, bit bytes, CRC-32
+HEADER_SIZE = 64
+
+# Numbers sieved per segment while the file grows (one byte of scratch each
+# for half of them), and the granularity the covered limit is rounded up to.
+BUILD_SEGMENT_SIZE = 1 << 25
+GROWTH_STEP = 1 << 20
+
+# Words of twin bits (each covering 128 numbers) scanned per step when counting.
+COUNT_CHUNK_WORDS = 1 << 18
+
+_ONE, _ALL_ONES = np.uint64(1), np.uint64(0xFFFFFFFFFFFFFFFF)
+_SPREAD_MASKS = [(np.uint64(shift), np.uint64(mask)) for shift, mask in (
+    (1, 0x3333333333333333), (2, 0x0F0F0F0F0F0F0F0F), (4, 0x00FF00FF00FF00FF),
+    (8, 0x0000FFFF0000FFFF), (16, 0x00000000FFFFFFFF))]
+
+
+@contextmanager
+def _locked(file, exclusive):
+    if fcntl is None:
+        yield
+        return
+    fcntl.flock(file.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+    try:
+        yield
+    finally:
+        fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+
+
+def odd_prime_bits(low, high, base_primes):
+    """
+    Sieves the odd numbers in [low, high), both multiples of 16, with base
+    primes covering sqrt(high). Returns a boolean array where entry j is True
+    if low + 2j + 1 is prime.
+    """
+    flags = np.ones((high - low) // 2, dtype=bool)
+    if low == 0:
+        flags[0] = False  # 1
+    for prime in base_primes[1:]:  # 2 never divides an odd number
+        if prime * prime >= high:
+            break
+        start = max(prime * prime, (low + prime - 1) // prime * prime)
+        if start % 2 == 0:
+            start += prime
+        flags[(start - low) // 2::prime] = False
+    return flags
+
+
+def word_popcount(words):
+    """
+    Returns the number of set bits in an array of uint64 words.
+    """
+    if hasattr(np, "bitwise_count"):  # NumPy 2.0 and later
+        return int(np.bitwise_count(words).sum(dtype=np.int64))
+    return int(np.unpackbits(words.view(np.uint8)).sum(dtype=np.int64))
+
+
+def split_even_odd_bits(words):
+    """
+    Splits a bitmap of an even number of uint64 words into two bitmaps of half
+    the length: the bits at even positions, and the bits at odd positions.
+    """
+    halves = []
+    for part in (words, words >> _ONE):
+        packed = part & np.uint64(0x5555555555555555)
+        for shift, mask in _SPREAD_MASKS:
+            packed = (packed | (packed >> shift)) & mask
+        halves.append(packed[0::2] | (packed[1::2] << np.uint64(32)))
+    return halves
+
+
+def shifted_words(words, shift, count):
+    """
+    Returns `count` words of the bitmap `words` read from bit `shift` on
+    (words must extend one word past the last one read).
+    """
+    word, bit = divmod(shift, 64)
+    low = words[word:word + count]
+    if bit == 0:
+        return low
+    return (low >> np.uint64(bit)) | (words[word + 1:word + count + 1] << np.uint64(64 - bit))
+
+
+def set_bits(words):
+    """
+    Returns the positions of the set bits of a uint64 bitmap, in order. Only
+    the non-zero words are unpacked.
+    """
+    occupied = np.flatnonzero(words)
+    bits = np.flatnonzero(np.unpackbits(words[occupied].view(np.uint8), bitorder='little'))
+    return 64 * occupied[bits >> 6] + (bits & 63)
+
+
+class SieveCache:
+    """
+    A memory-mapped, bit-packed sieve of the odd numbers below `limit`, stored
+    in `file_name` and shared between processes (see the notes above).
+    With verify=True the checksum is checked whenever the file is opened.
+    """
+
+    def __init__(self, file_name=DEFAULT_CACHE_FILE, verify=True):
+        self.file_name = file_name
+        self.verify = verify
+        self.file = os.fdopen(os.open(file_name, os.O_RDWR | os.O_CREAT, 0o644), 'r+b')
+        with _locked(self.file, exclusive=False):
+            self._load()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        # The bits may still be referenced elsewhere, so the mapping is left to
+        # close itself once they are gone.
+        self.bits = self._map = None
+        self.file.close()
+
+    def _load(self):
+        """
+        Maps the bits described by the header. Sets self.valid to False (with
+        nothing covered) if the file is empty, stale or corrupt.
+        """
+        self.limit, self.crc, self.valid = 0, 0, False
+        self.bits, self._map = np.zeros(0, dtype=np.uint8), None
+        self.file.seek(0)
+        header = self.file.read(HEADER_SIZE)
+        if len(header) < HEADER_SIZE:
+            return
+        magic, version, limit, byte_count, crc = _HEADER.unpack_from(header)
+        if (magic != MAGIC or version != VERSION or byte_count != limit // 16 or limit % 16
+                or os.fstat(self.file.fileno()).st_size < HEADER_SIZE + byte_count):
+            return
+        if byte_count:
+            self._map = mmap.mmap(self.file.fileno(), HEADER_SIZE + byte_count, access=mmap.ACCESS_READ)
+            bits = np.frombuffer(self._map, dtype=np.uint8, count=byte_count, offset=HEADER_SIZE)
+            if self.verify and zlib.crc32(bits) != crc:
+                return
+            self.bits = bits
+        self.limit, self.crc, self.valid = limit, crc, True
+
+    def ensure(self, limit):
+        """
+        Makes the cache cover every n < limit, extending the file if it does not
+        yet (or rebuilding it if it is stale or corrupt). Safe to call from
+        several processes at once: only one of them sieves.
+        """
+        if limit <= self.limit:
+            return
+        with _locked(self.file, exclusive=True):
+            # Another process may have grown the file while we waited for the lock.
+            self._load()
+            if limit > self.limit:
+                self._grow(-(-limit // GROWTH_STEP) * GROWTH_STEP)
+                self._load()
+
+    def _grow(self, limit):
+        low, crc = (self.limit, self.crc) if self.valid else (0, 0)
+        base_primes = small_primes(math.isqrt(limit))
+        self.file.truncate(HEADER_SIZE + low // 16)  # drop any tail of an interrupted growth
+        self.file.seek(HEADER_SIZE + low // 16)
+        while low < limit:
+            high = min(low + BUILD_SEGMENT_SIZE, limit)
+            packed = np.packbits(odd_prime_bits(low, high, base_primes), bitorder='little')
+            self.file.write(packed.tobytes())
+            crc = zlib.crc32(packed, crc)
+            low = high
+        # The header goes last, so a crash mid-growth leaves the old header valid.
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.seek(0)
+        self.file.write(_HEADER.pack(MAGIC, VERSION, limit, limit // 16, crc).ljust(HEADER_SIZE, b"\0"))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def are_prime(self, values):
+        """
+        Returns a boolean array (same shape as values) that is True where the value is prime.
+        Raises ValueError for values the cache does not cover.
+        """
+        values = np.asarray(values, dtype=np.int64)
+        if values.size and values.max() >= self.limit:
+            raise ValueError(f"sieve cache '{self.file_name}' covers n < {self.limit}, not {values.max()}")
+        odd = (values & 1 == 1) & (values > 0)
+        index = np.where(odd, values >> 1, 0)
+        return (odd & ((self.bits[index >> 3] >> (index & 7)) & 1 == 1)) | (values == 2)
+
+    def _covers(self, value):
+        if value >= self.limit:
+            raise ValueError(f"sieve cache '{self.file_name}' covers n < {self.limit}, not {value}")
+
+    def _words(self, first, stop):
+        """
+        Returns words first to stop - 1 of the sieve bits as uint64, with zeros
+        for words before the start or past the end of the file.
+        """
+        if 0 <= first and stop * 8 <= self.bits.size:
+            return self.bits[first * 8:stop * 8].view('<u8')
+        padded = np.zeros((stop - first) * 8, dtype=np.uint8)
+        low, high = max(first * 8, 0), min(stop * 8, self.bits.size)
+        if low < high:
+            padded[low - first * 8:high - first * 8] = self.bits[low:high]
+        return padded.view('<u8')
+
+    def twin_words(self, low, high):
+        """
+        Returns (first, words): bit k of the uint64 array `words` is set if
+        p = 2 * (first + k) + 1 is the first term of a twin prime pair with
+        low <= p < high. `first` is a multiple of 64.
+        """
+        self._covers(high + 1)
+        first, stop = low // 2, high // 2
+        if stop <= first:
+            return first // 64 * 64, np.zeros(0, dtype=np.uint64)
+        first_word, stop_word = first // 64, -(-stop // 64)
+        words = self._words(first_word, stop_word + 1)
+        twins = words[:-1] & ((words[:-1] >> _ONE) | (words[1:] << np.uint64(63)))
+        twins[0] &= _ALL_ONES << np.uint64(first % 64)
+        if stop % 64:
+            twins[-1] &= (_ONE << np.uint64(stop % 64)) - _ONE
+        return first_word * 64, twins
+
+    def twin_primes(self, low, high):
+        """
+        Returns the first terms p of the twin prime pairs with low <= p < high, as an array.
+        """
+        first, twins = self.twin_words(low, high)
+        return 2 * (first + set_bits(twins)) + 1
+
+    def offset_words(self, first, count, offsets):
+        """
+        Returns one bitmap of `count` words per offset, aligned with twin_words
+        from bit `first` (a multiple of 64) on: bit k is set if 2p + offset is
+        prime for p = 2 * (first + k) + 1. Offsets that are not of the form
+        2p + b with b odd (other multipliers, or never-odd q) get None.
+        """
+        shifts = {}
+        for offset in offsets:
+            a, b = coefficients(offset)
+            if a == 2 and b % 2 == 1:
+                shifts[offset] = (b + 1) // 2
+        if not shifts:
+            return [None] * len(offsets)
+        # q = 2p + b is sieve bit 2(first + k) + shift: bit first + k + shift // 2
+        # of the even (shift even) or odd (shift odd) bits of the sieve.
+        first_word = first // 64 + min(shifts.values()) // 2 // 64
+        stop_word = first // 64 + count + max(shifts.values()) // 2 // 64 + 2
+        halves = split_even_odd_bits(self._words(2 * first_word, 2 * stop_word))
+        return [shifted_words(halves[shifts[offset] % 2], first + shifts[offset] // 2 - 64 * first_word, count)
+                if offset in shifts else None for offset in offsets]
+
+    def count_twin_primes(self, low, high, offsets=(), chunk_words=COUNT_CHUNK_WORDS):
+        """
+        Counts the twin prime pairs with low <= p < high by popcount, without
+        listing them. Returns (pairs, successes), successes[j] being the number
+        of those p for which 2p + offsets[j] is prime.
+        """
+        self._covers(sieve_limit(high, offsets) if offsets else high + 1)
+        pairs, successes = 0, [0] * len(offsets)
+        for chunk_low in range(low, high, 128 * chunk_words):
+            first, twins = self.twin_words(chunk_low, min(chunk_low + 128 * chunk_words, high))
+            pairs += word_popcount(twins)
+            for column, words in enumerate(self.offset_words(first, len(twins), offsets)):
+                if words is None:  # other multipliers: look the q-values up one by one
+                    a, b = coefficients(offsets[column])
+                    successes[column] += int(self.are_prime(np.maximum(a * (2 * (first + set_bits(twins)) + 1) + b, 0)).sum())
+                else:
+                    successes[column] += word_popcount(twins & words)
+        return pairs, successes
+
+    def iter_twin_prime_segments(self, limit, start=0, segment_size=SEGMENT_SIZE):
+        """
+        Walks the twin primes with start <= p < limit like prime_sieve.iter_twin_prime_segments,
+        but reads them from the cache, which must cover limit + 2. The segments
+        carry no q-windows: q-values are looked up with are_prime.
+        """
+        for low in range(start, limit, segment_size):
+            high = min(low + segment_size, limit)
+            twin_ps = self.twin_primes(low, high)
+            yield TwinSegment(low, high, twin_ps, (twin_ps % 30).astype(np.uint8), {})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build, extend or check the shared sieve cache file.")
+    parser.add_argument("file", nargs="?", default=DEFAULT_CACHE_FILE, help=f"cache file (default: {DEFAULT_CACHE_FILE})")
+    parser.add_argument("--limit", type=float, help="extend the cache to cover every n < LIMIT")
+    parser.add_argument("--count-twins", type=float, metavar="N", help="count the twin prime pairs with p < N")
+    parser.add_argument("--offsets", type=parse_offsets, default=(),
+                        help="with --count-twins, also count the pairs for which 2p + offset is prime, e.g. '1,3,5'")
+    args = parser.parse_args()
+
+    with SieveCache(args.file) as cache:
+        if not cache.valid and os.path.getsize(args.file) > 0:
+            print(f"'{args.file}' is stale or corrupt" + (" and is being rebuilt." if args.limit else "; extend it to rebuild it."))
+        # 1. Extend the cache to the requested limit and to what the count needs
+        if args.limit:
+            cache.ensure(int(args.limit))
+        if args.count_twins:
+            count_limit = int(args.count_twins)
+            cache.ensure((sieve_limit(count_limit, args.offsets) if args.offsets else count_limit + 1) + 1)
+        print(f"'{args.file}' covers n < {cache.limit:,} ({cache.bits.size:,} bytes of bits).")
+
+        # 2. Popcount the twin bitmap and the per-offset success bitmaps
+        if args.count_twins:
+            started = time.perf_counter()
+            pairs, successes = cache.count_twin_primes(0, count_limit, args.offsets)
+            print(f"{pairs:,} twin prime pairs with p < {count_limit:,} ({time.perf_counter() - started:.2f} s)")
+            for offset, count in zip(args.offsets, successes):
+                print(f"  {form_label(offset)}: {count:,} prime ({count / pairs if pairs else 0:.2%})")
@@ -0,0 +1,274 @@
+import argparse
+import struct
+from collections import namedtuple
+
+import numpy as np
+
+from affine_forms import as_form, parse_offsets
+from offset_analysis import mask_dtype, offset_label, popcount
+from offset_table import _decode_offsets, _encode_offsets, load_offset_table, rechunk
+
+# A sorted, indexed store of the twin primes p and their success masks, for
+# rank/select and range queries without decoding the whole file.
+#
+# Layout (all little-endian, every section starting on an 8-byte boundary):
+#   header     magic (8 bytes), version (u8, as in offset_table.py), mask width
+#              in bytes (u8), number of offsets (u16), number of rows (u64),
+#              rows per block (u32), then the offsets as in offset_table.py
+#   first_p    u64 per block: the checkpoint p that starts the block
+#   delta_end  u64 per block: end of the block's deltas within the delta section
+#   width      u8 per block: bytes per delta in the block (1, 2 or 4)
+#   any_mask   one mask per block: the OR of its rows' masks
+#   histogram  u32 per block and success count 0..n: rows with that count
+#   mask       one mask per row; bit j is set if 2p + offsets[j] (or form j) is prime
+#   deltas     per block, the gaps (p[i + 1] - p[i]) / 2 in the block's width,
+#              each block padded to 4 bytes
+#
+# rank(x) finds its block by binary search over first_p and decodes that block
+# alone: O(log n + rows per block). Counts over a range take the histograms of
+# the blocks fully inside it, and filters skip blocks whose histogram or
+# any_mask rules them out.
+
+MAGIC = b"TPTWINIX"
+VERSION = 1
+FORMS_VERSION = 2
+_HEADER = struct.Struct("<8sBBHQI")
+
+BLOCK_ROWS = 4096
+
+_Layout = namedtuple("_Layout", ["first_p", "delta_end", "width", "any_mask", "histogram", "mask", "deltas"])
+
+
+def _align(size, alignment=8):
+    return size + (-size % alignment)
+
+
+def _layout(offset_count, version, mask_width, rows, block_rows):
+    blocks = -(-rows // block_rows)
+    sizes = [8 * blocks, 8 * blocks, blocks, mask_width * blocks, 4 * blocks * (offset_count + 1), mask_width * rows]
+    start = _align(_HEADER.size + 4 * offset_count * (3 if version == FORMS_VERSION else 1))
+    starts = []
+    for size in sizes:
+        starts.append(start)
+        start = _align(start + size)
+    return _Layout(*starts, start)
+
+
+def _delta_width(gaps):
+    largest = int(gaps.max()) if len(gaps) else 0
+    return 1 if largest < 1 << 8 else 2 if largest < 1 << 16 else 4
+
+
+def write_twin_index(file_name, offsets, p_chunks, mask_chunks, block_rows=BLOCK_ROWS):
+    """
+    Writes the index from matching sequences of sorted p arrays and mask arrays.
+    The chunks are read twice (masks, then p and masks by block), one block at a time.
+    """
+    masks_dtype = mask_dtype(len(offsets))
+    rows = sum(len(chunk) for chunk in p_chunks)
+    blocks = -(-rows // block_rows)
+    version, encoded = _encode_offsets(offsets)
+    layout = _layout(len(offsets), version, masks_dtype.itemsize, rows, block_rows)
+
+    first_p = np.zeros(blocks, dtype="<u8")
+    delta_end = np.zeros(blocks, dtype="<u8")
+    width = np.zeros(blocks, dtype=np.uint8)
+    any_mask = np.zeros(blocks, dtype=masks_dtype)
+    histogram = np.zeros((blocks, len(offsets) + 1), dtype="<u4")
+
+    with open(file_name, 'wb') as index_file:
+        index_file.write(_HEADER.pack(MAGIC, version, masks_dtype.itemsize, len(offsets), rows, block_rows))
+        index_file.write(encoded.tobytes())
+        index_file.seek(layout.mask)
+        for chunk in mask_chunks:
+            index_file.write(np.asarray(chunk, dtype=masks_dtype).tobytes())
+
+        index_file.seek(layout.deltas)
+        written = 0
+        for block, (p, masks) in enumerate(zip(rechunk(p_chunks, block_rows), rechunk(mask_chunks, block_rows))):
+            p = np.asarray(p, dtype=np.int64)
+            gaps = np.diff(p) // 2
+            width[block] = _delta_width(gaps)
+            deltas = gaps.astype(f"<u{width[block]}").tobytes()
+            deltas += bytes(-len(deltas) % 4)
+            index_file.write(deltas)
+            written += len(deltas)
+            first_p[block], delta_end[block] = p[0], written
+            any_mask[block] = np.bitwise_or.reduce(masks)
+            histogram[block] = np.bincount(popcount(masks), minlength=len(offsets) + 1)
+
+        # The block checkpoints are only known now; they go in front of the columns.
+        for start, column in zip(layout, (first_p, delta_end, width, any_mask, histogram)):
+            index_file.seek(start)
+            index_file.write(column.tobytes())
+        # An index without rows ends before its (empty) delta section; pad it to there.
+        index_file.truncate(layout.deltas + written)
+
+
+class TwinIndex:
+    """
+    A memory-mapped twin-prime index written by write_twin_index. Rows are the
+    twin primes in order; row k holds the k-th p (counting from 0) and its mask.
+    """
+
+    def __init__(self, file_name):
+        data = np.memmap(file_name, dtype=np.uint8, mode='r')
+        magic, version, mask_width, offset_count, rows, block_rows = _HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version not in (VERSION, FORMS_VERSION):
+            raise ValueError(f"'{file_name}' is not a version {VERSION} or {FORMS_VERSION} twin prime index")
+        layout = _layout(offset_count, version, mask_width, rows, block_rows)
+        blocks = -(-rows // block_rows)
+        if len(data) < layout.deltas:
+            raise ValueError(f"'{file_name}' is truncated")
+
+        self.data = data
+        self.offsets = _decode_offsets(data, _HEADER.size, offset_count, version)
+        self.rows, self.block_rows = rows, block_rows
+        self.first_p = data[layout.first_p:layout.first_p + 8 * blocks].view("<u8")
+        self.delta_end = data[layout.delta_end:layout.delta_end + 8 * blocks].view("<u8")
+        self.width = data[layout.width:layout.width + blocks]
+        self.any_mask = data[layout.any_mask:layout.any_mask + mask_width * blocks].view(f"<u{mask_width}")
+        self.histogram = data[layout.histogram:layout.histogram + 4 * blocks * (offset_count + 1)].view("<u4").reshape(
+            blocks, offset_count + 1)
+        self.mask = data[layout.mask:layout.mask + mask_width * rows].view(f"<u{mask_width}")
+        self.deltas_start = layout.deltas
+        if blocks and len(data) != layout.deltas + int(self.delta_end[-1]):
+            raise ValueError(f"'{file_name}' is truncated or has trailing data")
+
+    def __len__(self):
+        return self.rows
+
+    def block(self, block):
+        """
+        Decodes one block and returns its p-values as an int64 array.
+        """
+        start = int(self.delta_end[block - 1]) if block else 0
+        count = min(self.block_rows, self.rows - block * self.block_rows)
+        gaps = np.frombuffer(self.data, dtype=f"<u{self.width[block]}", count=count - 1,
+                             offset=self.deltas_start + start)
+        p = np.empty(count, dtype=np.int64)
+        p[0] = self.first_p[block]
+        np.cumsum(2 * gaps.astype(np.int64), out=p[1:])
+        p[1:] += p[0]
+        return p
+
+    def rank(self, x):
+        """
+        Returns the number of twin primes p < x.
+        """
+        if self.rows == 0 or x <= int(self.first_p[0]):
+            return 0
+        block = int(np.searchsorted(self.first_p, x)) - 1
+        return block * self.block_rows + int(np.searchsorted(self.block(block), x))
+
+    def select(self, k):
+        """
+        Returns the k-th twin prime p (counting from 0), so that rank(select(k)) == k.
+        """
+        if not 0 <= k < self.rows:
+            raise IndexError(f"twin prime index {k} is out of range (the index holds {self.rows})")
+        block, row = divmod(k, self.block_rows)
+        return int(self.block(block)[row])
+
+    def count(self, low, high):
+        """
+        Returns the number of twin primes with low <= p < high.
+        """
+        return max(self.rank(high) - self.rank(low), 0)
+
+    def success_histogram(self, low, high):
+        """
+        Returns an array whose entry k is the number of twin primes with
+        low <= p < high and exactly k successes. Only the masks of the two
+        partial blocks at the ends are read.
+        """
+        first, stop = self.rank(low), max(self.rank(high), self.rank(low))
+        counts = np.zeros(len(self.offsets) + 1, dtype=np.int64)
+        first_full, stop_full = -(-first // self.block_rows), stop // self.block_rows
+        if first_full < stop_full:
+            counts += self.histogram[first_full:stop_full].sum(axis=0, dtype=np.int64)
+            edges = [(first, first_full * self.block_rows), (stop_full * self.block_rows, stop)]
+        else:
+            edges = [(first, stop)]
+        for edge_first, edge_stop in edges:
+            counts += np.bincount(popcount(self.mask[edge_first:edge_stop]), minlength=len(counts))
+        return counts
+
+    def offset_mask(self, offsets):
+        """
+        Returns the mask with the bits of the given offsets or forms set.
+        Raises ValueError for one the index does not hold.
+        """
+        forms = [as_form(offset) for offset in self.offsets]
+        mask = 0
+        for offset in offsets:
+            if as_form(offset) not in forms:
+                raise ValueError(f"the index has no offset {offset_label(offset)}")
+            mask |= 1 << forms.index(as_form(offset))
+        return mask
+
+    def pairs(self, low, high, min_success=0, all_of=0, any_of=0):
+        """
+        Returns (p, mask) arrays for the twin primes with low <= p < high whose
+        success count is at least min_success, whose mask has every bit of
+        all_of and, if any_of is given, at least one bit of any_of.
+        Blocks that cannot hold a match are skipped without being decoded.
+        """
+        first, stop = self.rank(low), self.rank(high)
+        found_p, found_masks = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=self.mask.dtype)]
+        for block in range(first // self.block_rows, -(-stop // self.block_rows)):
+            any_mask = int(self.any_mask[block])
+            if (not self.histogram[block, min_success:].any() or any_mask & all_of != all_of
+                    or (any_of and not any_mask & any_of)):
+                continue
+            block_first = block * self.block_rows
+            rows = slice(max(first, block_first) - block_first, min(stop, block_first + self.block_rows) - block_first)
+            p = self.block(block)[rows]
+            masks = np.asarray(self.mask[block_first + rows.start:block_first + rows.stop])
+            keep = (popcount(masks) >= min_success) & (masks & all_of == all_of)
+            if any_of:
+                keep &= masks & any_of != 0
+            found_p.append(p[keep])
+            found_masks.append(masks[keep])
+        return np.concatenate(found_p), np.concatenate(found_masks)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or query an indexed twin prime store.")
+    parser.add_argument("index", help="index file (written by '7offsets_all reports.py --twin-index' or --build-from)")
+    parser.add_argument("--build-from", metavar="TABLE", help="first build the index from a main table .bin file")
+    parser.add_argument("--rank", type=int, metavar="X", help="number of twin primes p < X")
+    parser.add_argument("--select", type=int, metavar="K", help="the K-th twin prime p, counting from 0")
+    parser.add_argument("--count", type=int, nargs=2, metavar=("LOW", "HIGH"), help="twin primes with LOW <= p <= HIGH")
+    parser.add_argument("--pairs", type=int, nargs=2, metavar=("LOW", "HIGH"),
+                        help="list the twin primes with LOW <= p <= HIGH that pass the filters below")
+    parser.add_argument("--min-success", type=int, default=0, help="keep pairs with at least this many successes")
+    parser.add_argument("--all-of", metavar="LIST", help="keep pairs where all of these offsets succeeded, e.g. '1,-3'")
+    parser.add_argument("--any-of", metavar="LIST", help="keep pairs where any of these offsets succeeded")
+    args = parser.parse_args()
+
+    if args.build_from:
+        table = load_offset_table(args.build_from)
+        write_twin_index(args.index, table.offsets, [table.p], [table.mask])
+    index = TwinIndex(args.index)
+    print(f"'{args.index}': {len(index):,} twin primes, {len(index.first_p):,} blocks, "
+          f"offsets {' '.join(offset_label(offset) for offset in index.offsets)}")
+    if args.rank is not None:
+        print(f"rank({args.rank}) = {index.rank(args.rank)}")
+    if args.select is not None:
+        print(f"select({args.select}) = {index.select(args.select)}")
+    if args.count:
+        low, high = args.count
+        print(f"{index.count(low, high + 1)} twin primes with {low} <= p <= {high}; by success count: "
+              f"{index.success_histogram(low, high + 1).tolist()}")
+    if args.pairs:
+        low, high = args.pairs
+        try:
+            all_of = index.offset_mask(parse_offsets(args.all_of)) if args.all_of else 0
+            any_of = index.offset_mask(parse_offsets(args.any_of)) if args.any_of else 0
+        except ValueError as error:
+            parser.error(str(error))
+        p, masks = index.pairs(low, high + 1, args.min_success, all_of, any_of)
+        for p_value, mask in zip(p.tolist(), masks.tolist()):
+            succeeded = [offset_label(offset) for bit, offset in enumerate(index.offsets) if mask >> bit & 1]
+            print(f"{p_value}: {len(succeeded)} successes ({' '.join(succeeded)})")